@@ -1,17 +1,63 @@
+from app.cache import init_cache
 from app.container import Container
-from app.views import movies, ping, users
+from app.metrics import init_metrics
+from app.tracing import init_tracing
+from app.views import metrics, movies, ping, stats, users
 from flask import Flask
 from flask.logging import default_handler
 
-ACTIVE_ENDPOINTS = (("/", ping), ("/", users), ("/", movies))
+ACTIVE_ENDPOINTS = (
+    ("/", ping),
+    ("/", users),
+    ("/", movies),
+    ("/", stats),
+    ("/", metrics),
+)
 
 
 def create_app():
     app = Flask(__name__)
     app.logger.addHandler(default_handler)
     app.container = Container()
+    init_metrics(app)
+    init_tracing(app)
+    init_services(app)
+    init_catalog(app)
+    init_neighbors(app)
+    init_seen_items(app)
+    init_cache(app)
 
     for url, blueprint in ACTIVE_ENDPOINTS:
         app.register_blueprint(blueprint, url_prefix=url)
 
     return app
+
+
+def init_services(app):
+    sqldb = app.container.sql_db()
+
+    # Release the thread session so its connection goes back to the pool
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        sqldb.db_session.remove()
+
+    # Build the vector backend at startup so in-process indexes are loaded once,
+    # before the production server forks its workers
+    app.container.vector_db()
+
+
+def init_catalog(app):
+    # Load the movie catalog at startup instead of on the first request
+    catalog = app.container.catalog()
+    app.container.version_watcher().subscribe(catalog.load)
+    app.before_request(catalog.maybe_refresh)
+
+
+def init_neighbors(app):
+    neighbor_table = app.container.neighbor_table()
+    app.before_request(neighbor_table.maybe_reload)
+
+
+def init_seen_items(app):
+    seen_items = app.container.seen_items()
+    app.before_request(seen_items.maybe_refresh)
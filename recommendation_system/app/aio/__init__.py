@@ -0,0 +1,75 @@
+"""Asyncio version of the app, served by an ASGI server.
+
+The recommendation endpoints wait on Postgres and OpenSearch without holding a
+thread, so one worker serves many requests concurrently. It shares the container
+and the in-memory services (catalog, neighbor table, seen items) with the Flask app.
+"""
+
+import asyncio
+
+from app.aio.cache import init_cache
+from app.aio.metrics import init_metrics
+from app.aio.tracing import init_tracing
+from app.aio.views import metrics, movies, stats, users
+from app.container import Container
+from quart import Quart
+
+ACTIVE_ENDPOINTS = (("/", users), ("/", movies), ("/", stats), ("/", metrics))
+
+# Seconds between two runs of the periodic refresh of the in-memory services
+REFRESH_PERIOD = 1
+
+
+def create_async_app():
+    app = Quart(__name__)
+    app.container = Container()
+    init_metrics(app)
+    init_tracing(app)
+    init_services(app)
+    init_cache(app)
+
+    for url, blueprint in ACTIVE_ENDPOINTS:
+        app.register_blueprint(blueprint, url_prefix=url)
+
+    return app
+
+
+def init_services(app):
+    # Load the in-memory services at startup, before the server forks its workers
+    app.container.vector_db()
+    catalog = app.container.catalog()
+    app.container.neighbor_table()
+    app.container.seen_items()
+    app.container.version_watcher().subscribe(catalog.load)
+
+    @app.before_serving
+    async def start_refresh():
+        app.refresh_task = asyncio.create_task(refresh_services(app))
+
+    @app.after_serving
+    async def close_services():
+        app.refresh_task.cancel()
+        await app.container.async_sql_db().close()
+        await app.container.async_vector_db().close()
+
+
+async def refresh_services(app):
+    """Run the refresh hooks the Flask app runs before every request.
+
+    They are cheap when nothing is due, but can block on SQL, so they run in a
+    worker thread on a timer instead of on the event loop.
+    """
+    container = app.container
+    hooks = (
+        container.version_watcher().check,
+        container.catalog().maybe_refresh,
+        container.neighbor_table().maybe_reload,
+        container.seen_items().maybe_refresh,
+    )
+    while True:
+        for hook in hooks:
+            try:
+                await asyncio.to_thread(hook)
+            except Exception:
+                app.logger.exception("Error refreshing %s", hook.__qualname__)
+        await asyncio.sleep(REFRESH_PERIOD)
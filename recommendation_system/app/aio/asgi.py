@@ -0,0 +1,5 @@
+"""ASGI entry point of the asyncio app, served by gunicorn with uvicorn workers"""
+
+from app.aio import create_async_app
+
+app = create_async_app()
@@ -0,0 +1,73 @@
+"""Response cache of the asyncio endpoints"""
+
+import asyncio
+import functools
+import logging
+
+from app.cache import cache_key
+from core.services.cache import AsyncSingleFlight, LRUCache
+from core.services.metrics import observe_coalesced
+from core.services.tracing import capture
+from quart import copy_current_request_context, current_app, request
+
+logger = logging.getLogger(__name__)
+
+
+def init_cache(app):
+    config = app.container.config.cache()
+    app.cache = LRUCache(
+        threshold=config["max_entries"],
+        default_timeout=config["timeout"],
+        stale_timeout=config.get("stale_timeout", 0),
+    )
+    app.single_flight = AsyncSingleFlight()
+
+    # Cached responses are stale as soon as a new embedding version is loaded
+    app.container.version_watcher().subscribe(lambda version: app.cache.clear())
+
+
+def cached(*arg_names):
+    """Cache the responses of an async view like `app.cache.cached` does.
+
+    Concurrent requests with the same key await a single computation, and stale
+    responses are computed again in a background task.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            key = cache_key(arg_names, request.path, request.args)
+            app_cache, single_flight = current_app.cache, current_app.single_flight
+
+            async def compute():
+                response = await view(*args, **kwargs)
+                app_cache.set(key, response)
+                return response
+
+            entry = app_cache.lookup(key)
+            if entry is not None:
+                response, fresh = entry
+                if not fresh and not single_flight.running(key):
+                    asyncio.ensure_future(
+                        refresh(
+                            single_flight, key, copy_current_request_context(compute)
+                        )
+                    )
+                return response
+
+            response, shared = await single_flight.do(key, compute)
+            if shared:
+                observe_coalesced()
+                capture("coalesced", key)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+async def refresh(single_flight, key, compute):
+    try:
+        await single_flight.do(key, compute)
+    except Exception:
+        logger.exception(f"Could not refresh the cached response {key}")
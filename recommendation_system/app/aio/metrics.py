@@ -0,0 +1,34 @@
+"""Request metrics of the asyncio app, see `app.metrics`"""
+
+import time
+
+from core.services.metrics import endpoint_label, observe_request, set_endpoint, stage
+from quart import g, request
+from quart.json.provider import DefaultJSONProvider
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Time the JSON serialization of the responses as a stage"""
+
+    def dumps(self, obj, **kwargs):
+        with stage("serialization"):
+            return super().dumps(obj, **kwargs)
+
+
+def init_metrics(app):
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    async def start_request():
+        g.request_start = time.perf_counter()
+        set_endpoint(endpoint_label(request.url_rule and request.url_rule.rule))
+
+    @app.after_request
+    async def record_request(response):
+        observe_request(
+            endpoint_label(request.url_rule and request.url_rule.rule),
+            request.method,
+            response.status_code,
+            time.perf_counter() - g.request_start,
+        )
+        return response
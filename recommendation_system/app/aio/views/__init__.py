@@ -0,0 +1,6 @@
+from app.aio.views.metrics import metrics
+from app.aio.views.movies import movies
+from app.aio.views.stats import stats
+from app.aio.views.users import users
+
+__all__ = ["users", "movies", "stats", "metrics"]
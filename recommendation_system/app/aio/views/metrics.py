@@ -0,0 +1,12 @@
+"""Module with the asyncio Prometheus metrics endpoint"""
+
+from core.services.metrics import render_metrics
+from quart import Blueprint, Response
+
+metrics = Blueprint("async_metrics", __name__)
+
+
+@metrics.route("/metrics", methods=["GET"])
+async def get_metrics():
+    data, content_type = render_metrics()
+    return Response(data, content_type=content_type)
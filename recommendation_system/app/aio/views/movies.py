@@ -0,0 +1,91 @@
+"""Module with the asyncio movies endpoints"""
+
+import asyncio
+
+from app.aio.cache import cached
+from app.views.arguments import parse_count, parse_search_overrides
+from core.services.database import (
+    InvalidVectorSearch,
+    SearchParams,
+    VectorSearchUnavailable,
+    VMovie,
+)
+from core.services.metrics import stage
+from core.services.tracing import capture
+from quart import Blueprint, current_app, request
+
+movies = Blueprint("async_movies", __name__)
+
+
+@movies.errorhandler(InvalidVectorSearch)
+async def invalid_search(error):
+    return {"msg": str(error)}, 400
+
+
+@movies.route("/movie/<movie_id>", methods=["GET"])
+@cached("neighbors", "num_candidates", "ef_search", "genres", "year_from", "year_to")
+async def get_movie(movie_id):
+    vdb = current_app.container.async_vector_db()
+    sqldb = current_app.container.async_sql_db()
+    catalog = current_app.container.catalog()
+    neighbor_table = current_app.container.neighbor_table()
+
+    try:
+        neighbors = parse_count(request.args.get("neighbors", 20), "neighbors")
+        overrides = parse_search_overrides(request.args)
+    except ValueError as error:
+        return {"msg": str(error)}, 400
+    params = SearchParams.from_config(
+        current_app.container.config.search.movie(), overrides
+    )
+    params = params._replace(
+        filter=catalog.search_filter(
+            genres=[g for g in request.args.get("genres", "").split(",") if g],
+            year_from=request.args.get("year_from", type=int),
+            year_to=request.args.get("year_to", type=int),
+        )
+    )
+
+    movie = await asyncio.to_thread(catalog.get, int(movie_id))
+
+    if not movie:
+        return {"msg": f"There is no movie with ID {movie_id}"}, 200
+
+    result = {
+        "movie_id": movie["movie_id"],
+        "name": movie["name"],
+        "year": movie["year"],
+        "genres": movie["genres"],
+        "recommendations": [],
+    }
+    embedding = catalog.embedding(movie["movie_id"])
+    if embedding is None:
+        return result, 200
+
+    # Serve the precomputed neighbors, the live search is only a fallback. The
+    # table is not filtered, so filtered requests always search.
+    hits = None
+    if params.filter is None:
+        with stage("neighbor_table"):
+            hits = neighbor_table.lookup(movie["movie_id"], neighbors)
+    if hits is None:
+        try:
+            hits = await vdb.knn_search(
+                VMovie.Index.name, embedding, size=neighbors + 1, params=params
+            )
+        except VectorSearchUnavailable:
+            # Degrade to the popular movies, which have no similarity score
+            with stage("popular_sql"):
+                popular = await sqldb.get_popular_movies(neighbors + 1)
+            hits = [(m, None) for m in popular]
+    capture("hits", hits)
+    scores = {hit_id: score for hit_id, score in hits if hit_id != movie["movie_id"]}
+    with stage("enrichment"):
+        recommendations = await asyncio.to_thread(
+            catalog.describe, list(scores)[:neighbors]
+        )
+    for recommendation in recommendations:
+        recommendation["score"] = scores[recommendation["movie_id"]]
+    capture("recommendations", recommendations)
+    result["recommendations"] = recommendations
+    return result, 200
@@ -0,0 +1,14 @@
+"""Module with the asyncio serving statistics endpoints"""
+
+from quart import Blueprint, current_app
+
+stats = Blueprint("async_stats", __name__)
+
+
+@stats.route("/stats/pools", methods=["GET"])
+async def get_pool_stats():
+    """Usage of the Postgres and OpenSearch connection pools of this process"""
+    return {
+        "sql": current_app.container.async_sql_db().pool_stats(),
+        "vector_db": current_app.container.async_vector_db().pool_stats(),
+    }, 200
@@ -0,0 +1,142 @@
+"""Module with the asyncio users endpoints"""
+
+import asyncio
+
+from app.aio.cache import cached
+from app.views.arguments import parse_count, parse_search_overrides
+from app.views.users import MODES, SEED_NEIGHBORS, GetUserService
+from core.services.database import (
+    DatabaseService,
+    InvalidVectorSearch,
+    SearchParams,
+    User,
+    VectorSearchUnavailable,
+    VMovie,
+)
+from core.services.metrics import stage
+from core.services.tracing import capture
+from quart import Blueprint, current_app, request
+from sqlalchemy import select
+
+users = Blueprint("async_users", __name__)
+
+
+@users.errorhandler(InvalidVectorSearch)
+async def invalid_search(error):
+    return {"msg": str(error)}, 400
+
+
+@users.route("/user/<user_id>", methods=["GET"])
+@cached("n", "mode", "num_candidates", "ef_search")
+async def get_user(user_id):
+    try:
+        n = parse_count(request.args.get("n", 5), "n")
+        overrides = parse_search_overrides(request.args)
+    except ValueError as error:
+        return {"msg": str(error)}, 400
+    mode = request.args.get("mode", current_app.container.config.users.mode())
+    if mode not in MODES:
+        return {"msg": f"The mode must be one of {', '.join(MODES)}"}, 400
+    params = SearchParams.from_config(
+        current_app.container.config.search.user(), overrides
+    )
+
+    return await recommend(int(user_id), n, mode, params), 200
+
+
+async def recommend(user_id, n, mode, params=None):
+    """Recommend `n` movies to the user, like `GetUserService.recommend` does.
+
+    In seeds mode the user and their seeds are queried concurrently.
+    """
+    sqldb = current_app.container.async_sql_db()
+    catalog = current_app.container.catalog()
+
+    user_query = select(User.id, User.name, User.embedding).where(User.id == user_id)
+    seeds = None
+    if mode == "seeds":
+        rows, seeds = await asyncio.gather(
+            get_user_row(sqldb, user_query), get_seeds(sqldb, user_id, n)
+        )
+    else:
+        rows = await get_user_row(sqldb, user_query)
+    if not rows:
+        return {"msg": f"There is no user with ID {user_id}"}
+    user = rows[0]
+
+    ranking = None
+    if mode == "embedding" and user.embedding:
+        ranking = await rank_by_embedding(user_id, user.embedding, n, params)
+    if not ranking:
+        if seeds is None:
+            seeds = await get_seeds(sqldb, user_id, n)
+        ranking = await rank_by_seeds(user_id, seeds, n, params)
+
+    capture("ranking", ranking)
+    if not ranking:
+        with stage("popular_sql"):
+            ranking = await sqldb.get_popular_movies(n)
+    with stage("enrichment"):
+        recommendations = await asyncio.to_thread(catalog.describe, ranking)
+    return {"user_id": user_id, "name": user.name, "recommendations": recommendations}
+
+
+async def get_user_row(sqldb, user_query):
+    with stage("user_sql"):
+        return await sqldb.execute(user_query)
+
+
+async def get_seeds(sqldb, user_id, n):
+    """Get the top n movies that the user rated with 4 or more"""
+    with stage("seed_sql"):
+        rows = await sqldb.execute(DatabaseService.seeds_query([user_id], n))
+    return [movie_id for _, movie_id in rows]
+
+
+async def rank_by_embedding(user_id, embedding, n, params=None):
+    """Rank movies with a single search with the user embedding"""
+    vdb = current_app.container.async_vector_db()
+    seen_items = current_app.container.seen_items()
+    max_overfetch = current_app.container.config.seen.max_overfetch()
+
+    overfetch = min(len(seen_items.seen(user_id)), max_overfetch)
+    try:
+        hits = await vdb.knn_search(
+            VMovie.Index.name, embedding, size=n + overfetch, params=params
+        )
+    except VectorSearchUnavailable:
+        return []
+    return seen_items.unseen(user_id, [m for m, _ in hits])[:n]
+
+
+async def rank_by_seeds(user_id, seeds, n, params=None):
+    """Rank movies by merging the neighbors of the user top rated movies.
+
+    The search of every seed is sent at once and they all run concurrently.
+    """
+    vdb = current_app.container.async_vector_db()
+    catalog = current_app.container.catalog()
+    seen_items = current_app.container.seen_items()
+    seed_overfetch = current_app.container.config.seen.seed_overfetch()
+
+    seed_ids, embeddings = await asyncio.to_thread(catalog.embeddings, seeds)
+    if not len(seed_ids):
+        return []
+    try:
+        hits = await asyncio.gather(
+            *(
+                vdb.knn_search(
+                    VMovie.Index.name,
+                    embedding,
+                    size=SEED_NEIGHBORS + seed_overfetch,
+                    params=params,
+                )
+                for embedding in embeddings.tolist()
+            )
+        )
+    except VectorSearchUnavailable:
+        return []
+
+    seed_ids = seed_ids.tolist()
+    ranking = GetUserService.merge_hits(hits, exclude=seed_ids)
+    return seen_items.unseen(user_id, ranking)[:n]
@@ -0,0 +1,93 @@
+"""Response cache shared by the recommendation endpoints"""
+
+import contextvars
+import functools
+import logging
+import threading
+
+from core.services.cache import SingleFlight
+from core.services.metrics import observe_coalesced
+from core.services.tracing import capture
+from flask import copy_current_request_context, request
+from flask_caching import Cache
+
+logger = logging.getLogger(__name__)
+
+cache = Cache()
+single_flight = SingleFlight()
+
+
+def init_cache(app):
+    config = app.container.config.cache()
+    cache.init_app(
+        app,
+        config={
+            "CACHE_TYPE": "core.services.cache.LRUCache",
+            "CACHE_DEFAULT_TIMEOUT": config["timeout"],
+            "CACHE_THRESHOLD": config["max_entries"],
+            "CACHE_STALE_TIMEOUT": config.get("stale_timeout", 0),
+        },
+    )
+
+    # Cached responses are stale as soon as a new embedding version is loaded
+    watcher = app.container.version_watcher()
+    watcher.subscribe(lambda version: cache.clear())
+    app.before_request(watcher.check)
+
+
+def cache_key(arg_names, path, args):
+    """Build the cache key of a request from its path and the given query args.
+
+    Any other query argument is ignored so it can not fragment the cache.
+    """
+    params = "&".join(f"{name}={args.get(name, '')}" for name in arg_names)
+    return f"view/{path}?{params}"
+
+
+def cached(*arg_names):
+    """Cache the responses of a view by request path and the given query args.
+
+    Concurrent requests with the same key share a single computation. Expired
+    responses are still served for `cache.stale_timeout` seconds while a
+    background thread computes them again.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = cache_key(arg_names, request.path, request.args)
+
+            def compute():
+                response = view(*args, **kwargs)
+                cache.cache.set(key, response)
+                return response
+
+            entry = cache.cache.lookup(key)
+            if entry is not None:
+                response, fresh = entry
+                if not fresh and not single_flight.running(key):
+                    refresh(key, copy_current_request_context(compute))
+                return response
+
+            response, shared = single_flight.do(key, compute)
+            if shared:
+                observe_coalesced()
+                capture("coalesced", key)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def refresh(key, compute):
+    """Compute a stale response again in a background thread"""
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            single_flight.do(key, compute)
+        except Exception:
+            logger.exception(f"Could not refresh the cached response {key}")
+
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
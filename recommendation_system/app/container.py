@@ -1,5 +1,15 @@
+from core.services.catalog import MovieCatalog
 from core.services.configuration import ConfigurationManager
-from core.services.database import DatabaseService, VectorDBService
+from core.services.database import (
+    AsyncDatabaseService,
+    AsyncVectorDBService,
+    CatalogBackend,
+    DatabaseService,
+    EmbeddingVersionWatcher,
+    VectorDBService,
+)
+from core.services.neighbors import NeighborTable
+from core.services.seen import SeenItemsIndex
 from dependency_injector import containers, providers
 
 
@@ -10,4 +20,35 @@ class Container(containers.DeclarativeContainer):
     config.from_dict(ConfigurationManager.init_config())
 
     sql_db = providers.Singleton(DatabaseService, config=config.sql)
-    vector_db = providers.Singleton(VectorDBService, config=config.elastic)
+    catalog = providers.Singleton(
+        MovieCatalog,
+        sqldb=sql_db,
+        refresh_interval=config.catalog.refresh_interval,
+    )
+    # Answers the movie searches from the catalog when the vector backend can not
+    vector_db = providers.Singleton(
+        VectorDBService,
+        config=config.elastic,
+        fallback=providers.Singleton(CatalogBackend, catalog=catalog),
+    )
+    # Only built by the asyncio app, inside the event loop of every worker
+    async_sql_db = providers.Singleton(AsyncDatabaseService, config=config.sql)
+    async_vector_db = providers.Singleton(
+        AsyncVectorDBService, config=config.elastic, vector_db=vector_db
+    )
+    version_watcher = providers.Singleton(
+        EmbeddingVersionWatcher,
+        sqldb=sql_db,
+        interval=config.embeddings.version_check_interval,
+    )
+    neighbor_table = providers.Singleton(
+        NeighborTable,
+        path=config.neighbors.path,
+        watcher=version_watcher,
+        reload_interval=config.neighbors.reload_interval,
+    )
+    seen_items = providers.Singleton(
+        SeenItemsIndex,
+        sqldb=sql_db,
+        refresh_interval=config.seen.refresh_interval,
+    )
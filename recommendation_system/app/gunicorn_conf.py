@@ -0,0 +1,43 @@
+"""Gunicorn configuration for the production server.
+
+The application is loaded once in the master process before forking the workers,
+so the read-only artifacts (embedding matrices, id maps, the movie catalog) are
+shared with every worker instead of being loaded again by each of them.
+
+The same configuration serves the asyncio app with uvicorn workers:
+`gunicorn --config app/gunicorn_conf.py -k uvicorn.workers.UvicornWorker app.aio.asgi:app`
+"""
+
+import os
+import tempfile
+
+from core.services.configuration import ConfigurationManager
+
+server = ConfigurationManager.init_config()["server"]
+
+bind = server["bind"]
+workers = server["workers"]
+threads = server["threads"]
+timeout = server["timeout"]
+preload_app = True
+
+# Every worker writes its metrics to this directory so /metrics can report them all.
+# It has to be set before the app, and the metrics, are imported.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="recsys-metrics-")
+)
+
+
+def post_fork(server, worker):
+    # The preloaded app, either the Flask one or the asyncio one
+    app = server.app.wsgi()
+
+    # Connections opened by the master while loading the app can not be shared
+    # between processes, every worker opens its own.
+    app.container.sql_db().engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,34 @@
+"""Request metrics of the app, served in the Prometheus text format at /metrics"""
+
+import time
+
+from core.services.metrics import endpoint_label, observe_request, set_endpoint, stage
+from flask import g, request
+from flask_restx.representations import output_json
+
+
+def init_metrics(app):
+    # Registered before the other hooks so the request latency includes them
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        set_endpoint(endpoint_label(request.url_rule and request.url_rule.rule))
+
+    @app.after_request
+    def record_request(response):
+        observe_request(
+            endpoint_label(request.url_rule and request.url_rule.rule),
+            request.method,
+            response.status_code,
+            time.perf_counter() - g.request_start,
+        )
+        return response
+
+
+def timed_representation(api):
+    """Time the JSON serialization of the responses of `api` as a stage"""
+
+    @api.representation("application/json")
+    def output_timed_json(data, code, headers=None):
+        with stage("serialization"):
+            return output_json(data, code, headers)
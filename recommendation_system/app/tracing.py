@@ -0,0 +1,33 @@
+"""Request tracing of the app, see `core.services.tracing`"""
+
+from core.services.metrics import endpoint_label
+from core.services.tracing import configure_trace_logger, finish_trace, start_trace
+from flask import request
+
+# Requests with this header keep the trace id of the caller, it is always returned
+TRACE_HEADER = "X-Trace-Id"
+
+
+def init_tracing(app):
+    config = app.container.config.tracing()
+    configure_trace_logger()
+
+    @app.before_request
+    def start_request_trace():
+        start_trace(
+            endpoint_label(request.url_rule and request.url_rule.rule),
+            trace_id=request.headers.get(TRACE_HEADER),
+            sample_rate=config["sample_rate"],
+        )
+
+    @app.after_request
+    def finish_request_trace(response):
+        trace = finish_trace(
+            config["slow_threshold_ms"],
+            method=request.method,
+            path=request.full_path,
+            status=response.status_code,
+        )
+        if trace is not None:
+            response.headers[TRACE_HEADER] = trace.trace_id
+        return response
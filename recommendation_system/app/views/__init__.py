@@ -1,5 +1,7 @@
+from app.views.metrics import metrics
 from app.views.movies import movies
 from app.views.ping import ping
+from app.views.stats import stats
 from app.views.users import users
 
-__all__ = ["users", "movies", "ping"]
+__all__ = ["users", "movies", "ping", "stats", "metrics"]
@@ -0,0 +1,41 @@
+"""Validation of the request arguments shared by the endpoints"""
+
+# Largest number of results a request can ask for
+MAX_RESULTS = 1000
+
+# Largest `num_candidates` and `ef_search` a request can ask for, the k of the
+# k-NN query also holds the excluded movies and OpenSearch caps it at 10000
+MAX_CANDIDATES = 5000
+
+# Search params a request can override, see SearchParams.from_config
+SEARCH_OVERRIDES = ("num_candidates", "ef_search")
+
+
+def parse_count(value, name, minimum=0, maximum=MAX_RESULTS):
+    """Parse a number of results, raising ValueError with the message of the 400"""
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer") from None
+    if count < minimum:
+        raise ValueError(f"{name} must be at least {minimum}")
+    if count > maximum:
+        raise ValueError(f"{name} can not be more than {maximum}")
+    return count
+
+
+def parse_search_overrides(args):
+    """Parse the search params overridden by `args`, the query args or the body"""
+    return {
+        name: parse_count(args[name], name, minimum=1, maximum=MAX_CANDIDATES)
+        for name in SEARCH_OVERRIDES
+        if args.get(name)
+    }
+
+
+def parse_ids(values, name):
+    """Parse a list of ids, raising ValueError with the message of the 400"""
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        raise ValueError(f"Every item of {name} must be an integer") from None
@@ -0,0 +1,12 @@
+"""Module with the Prometheus metrics endpoint"""
+
+from core.services.metrics import render_metrics
+from flask import Blueprint, Response
+
+metrics = Blueprint("metrics", __name__)
+
+
+@metrics.route("/metrics", methods=["GET"])
+def get_metrics():
+    data, content_type = render_metrics()
+    return Response(data, content_type=content_type)
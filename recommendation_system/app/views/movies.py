@@ -1,8 +1,17 @@
 """Module with movies endpoints"""
 
-from core.services.database import Movie, VMovie
+from app.cache import cached
+from app.metrics import timed_representation
+from app.views.arguments import parse_count, parse_search_overrides
+from core.services.database import (
+    InvalidVectorSearch,
+    SearchParams,
+    VectorSearchUnavailable,
+    VMovie,
+)
+from core.services.metrics import stage
+from core.services.tracing import capture
 from flask import Blueprint, current_app, request
-from flask_caching import Cache
 from flask_restx import Api, Resource
 
 movies = Blueprint("movies", __name__)
@@ -12,74 +21,100 @@ api = Api(
     title="Movies Endpoints",
     description="Endpoints to get Movies recommendations",
 )
+timed_representation(api)
+
 
-cache = Cache()
+@api.errorhandler(InvalidVectorSearch)
+def invalid_search(error):
+    return {"msg": str(error)}, 400
 
 
-@cache.cached(timeout=60)
 @api.route("/movie/<movie_id>", methods=["GET"])
 class GetUserService(Resource):
 
+    @cached(
+        "neighbors", "num_candidates", "ef_search", "genres", "year_from", "year_to"
+    )
     def get(self, movie_id):
         vdb = current_app.container.vector_db()
         sqldb = current_app.container.sql_db()
+        catalog = current_app.container.catalog()
+        neighbor_table = current_app.container.neighbor_table()
 
-        neighbors = int(request.args.get("neighbors", 20))
+        try:
+            neighbors = parse_count(request.args.get("neighbors", 20), "neighbors")
+            overrides = parse_search_overrides(request.args)
+        except ValueError as error:
+            return {"msg": str(error)}, 400
+        params = SearchParams.from_config(
+            current_app.container.config.search.movie(), overrides
+        )
+        params = params._replace(
+            filter=catalog.search_filter(
+                genres=[g for g in request.args.get("genres", "").split(",") if g],
+                year_from=request.args.get("year_from", type=int),
+                year_to=request.args.get("year_to", type=int),
+            )
+        )
 
-        movie = sqldb.db_session.query(Movie).filter(Movie.id == movie_id).first()
+        movie = catalog.get(int(movie_id))
 
         if not movie:
             return {"msg": f"There is no movie with ID {movie_id}"}, 200
 
-        current_app.logger.info(movie.name)
-        query = {
-            "size": neighbors + 1,
-            "query": {
-                "knn": {
-                    "vector": {
-                        "vector": movie.embedding,
-                        "k": len(movie.embedding),
-                    }
-                }
-            },
-        }
-
-        current_app.logger.info(query)
-        response = vdb.client.search(index=VMovie.Index.name, body=query)
-        current_app.logger.info(response)
         result = {
-            "movie_id": movie.id,
-            "name": movie.name,
-            "year": movie.release_date.year,
-            "genres": movie.genres,
+            "movie_id": movie["movie_id"],
+            "name": movie["name"],
+            "year": movie["year"],
+            "genres": movie["genres"],
+            "recommendations": [],
         }
-        if hits := response.get("hits", {}).get("hits", {}):
-            recommendations = [
-                {
-                    "movie_id": hit["_source"]["movie_id"],
-                    "name": hit["_source"]["name"],
-                    "url": hit["_source"]["url"],
-                    "score": hit["_score"],
-                }
-                for hit in hits
-                if hit["_source"]["movie_id"] != movie.id
-            ]
-            recommendations = self.get_genres(sqldb, recommendations)
-            current_app.logger.info(recommendations)
-            result["recommendations"] = recommendations
+        embedding = catalog.embedding(movie["movie_id"])
+        if embedding is None:
             return result, 200
 
-    @staticmethod
-    def get_genres(sqldb, recommendations):
-        ids = [i["movie_id"] for i in recommendations]
-        response = (
-            sqldb.db_session.query(Movie.id, Movie.release_date, Movie.genres)
-            .filter(Movie.id.in_(ids))
-            .all()
-        )
-        response = {key: {"release_date": rd, "genres": g} for key, rd, g in response}
-        for r in recommendations:
-            r["year"] = response[r["movie_id"]]["release_date"].year
-            r["genres"] = response[r["movie_id"]]["genres"]
-        current_app.logger.info(recommendations)
-        return recommendations
+        # Serve the precomputed neighbors, the live search is only a fallback. The
+        # table is not filtered, so filtered requests always search.
+        hits = None
+        if params.filter is None:
+            with stage("neighbor_table"):
+                hits = neighbor_table.lookup(movie["movie_id"], neighbors)
+        if hits is None:
+            try:
+                hits = vdb.knn_search(
+                    VMovie.Index.name, embedding, size=neighbors + 1, params=params
+                )
+            except VectorSearchUnavailable:
+                # Degrade to the popular movies, which have no similarity score
+                with stage("popular_sql"):
+                    hits = [(m, None) for m in sqldb.get_popular_movies(neighbors + 1)]
+        capture("hits", hits)
+        scores = {
+            hit_id: score for hit_id, score in hits if hit_id != movie["movie_id"]
+        }
+        with stage("enrichment"):
+            recommendations = catalog.describe(list(scores)[:neighbors])
+        for recommendation in recommendations:
+            recommendation["score"] = scores[recommendation["movie_id"]]
+        capture("recommendations", recommendations)
+        result["recommendations"] = recommendations
+        return result, 200
+
+
+@api.route("/movies/popular", methods=["GET"])
+class GetPopularService(Resource):
+
+    @cached("n")
+    def get(self):
+        sqldb = current_app.container.sql_db()
+        catalog = current_app.container.catalog()
+
+        try:
+            n = parse_count(request.args.get("n", 20), "n")
+        except ValueError as error:
+            return {"msg": str(error)}, 400
+
+        with stage("popular_sql"):
+            popular = sqldb.get_popular_movies(n)
+        with stage("enrichment"):
+            return {"recommendations": catalog.describe(popular)}, 200
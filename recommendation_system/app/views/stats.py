@@ -0,0 +1,20 @@
+"""Module with the serving statistics endpoints"""
+
+from flask import Blueprint, current_app
+from flask_restx import Api, Resource
+
+stats = Blueprint("stats", __name__)
+
+api = Api(stats, title="Stats Endpoints", description="Live serving statistics")
+
+
+@api.route("/stats/pools", methods=["GET"])
+class GetPoolStatsService(Resource):
+
+    @staticmethod
+    def get():
+        """Usage of the Postgres and OpenSearch connection pools of this process"""
+        return {
+            "sql": current_app.container.sql_db().pool_stats(),
+            "vector_db": current_app.container.vector_db().pool_stats(),
+        }, 200
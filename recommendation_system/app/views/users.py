@@ -1,143 +1,291 @@
 """Module with users endpoints"""
 
-from multiprocessing.pool import ThreadPool
+import json
 
-from core.services.database import Movie, Rating, User, VMovie
-from flask import Blueprint, current_app, request
-from flask_caching import Cache
+from app.cache import cached
+from app.metrics import timed_representation
+from app.views.arguments import parse_count, parse_ids, parse_search_overrides
+from core.services.database import (
+    InvalidVectorSearch,
+    SearchParams,
+    User,
+    VectorSearchUnavailable,
+    VMovie,
+)
+from core.services.metrics import stage
+from core.services.tracing import capture
+from flask import Blueprint, Response, current_app, request, stream_with_context
 from flask_restx import Api, Resource
-from sqlalchemy import func
 
 users = Blueprint("users", __name__)
 
 api = Api(
     users, title="Users Endpoints", description="Endpoints to get Users recommendations"
 )
+timed_representation(api)
+
+
+@api.errorhandler(InvalidVectorSearch)
+def invalid_search(error):
+    return {"msg": str(error)}, 400
 
-cache = Cache()
+# Number of neighbors retrieved for every seed movie before merging the rankings
+SEED_NEIGHBORS = 5
+
+# "embedding" runs one search with the user embedding, "seeds" one per top rated movie
+MODES = ("embedding", "seeds")
 
 
-@cache.cached(timeout=60)
 @api.route("/user/<user_id>", methods=["GET"])
 class GetUserService(Resource):
 
+    @cached("n", "mode", "num_candidates", "ef_search")
     def get(self, user_id):
         vdb = current_app.container.vector_db()
         sqldb = current_app.container.sql_db()
+        catalog = current_app.container.catalog()
+        seen_items = current_app.container.seen_items()
 
-        n = int(request.args.get("n", 5))
-        if not sqldb.db_session.query(User.id).filter(User.id == user_id).first():
-            return {"msg": f"There is no user with ID {user_id}"}, 200
-
-        # Get the top n movies that the user rate with 4 or more.
-        user = (
-            sqldb.db_session.query(
-                User.id.label("user_id"),
-                User.name.label("user_name"),
-                Rating.rating,
-                Movie.id.label("movie_id"),
-                Movie.embedding,
-            )
-            .join(Rating, User.id == Rating.user_id, isouter=True)
-            .join(Movie, Rating.movie_id == Movie.id, isouter=True)
-            .filter(User.id == user_id, Rating.rating >= 4)
-            .order_by(Rating.rating.desc())
-            .limit(n)
-            .all()
+        try:
+            n = parse_count(request.args.get("n", 5), "n")
+            overrides = parse_search_overrides(request.args)
+        except ValueError as error:
+            return {"msg": str(error)}, 400
+        mode = request.args.get("mode", current_app.container.config.users.mode())
+        if mode not in MODES:
+            return {"msg": f"The mode must be one of {', '.join(MODES)}"}, 400
+        params = SearchParams.from_config(
+            current_app.container.config.search.user(), overrides
         )
-        results = {"user_id": user[0].user_id, "name": user[0].user_name}
-        if user:
-            movie_ids = [u.movie_id for u in user]
-            items = [(vdb, u.embedding, movie_ids) for u in user]
-            with ThreadPool() as pool:
-                movies = pool.starmap(self.get_recommendation, items)
 
-            movie_ids = [m["movie_id"] for m in movies if m]
-            movie_stats = self.get_movie_stats(sqldb, movie_ids)
+        results = self.recommend(
+            sqldb, vdb, catalog, seen_items, [int(user_id)], n, mode, params
+        )
+        return results[0], 200
 
-            results["recommendations"] = movie_stats
+    @classmethod
+    def recommend(
+        cls, sqldb, vdb, catalog, seen_items, user_ids, n, mode="seeds", params=None
+    ):
+        """Recommend `n` movies to every user, in the order of `user_ids`.
 
-        else:
-            movies = self.get_fallback(sqldb, n)
-            results["recommendations"] = movies
+        In embedding mode every user with an embedding gets one search with their
+        embedding. The others, and every user in seeds mode, are recommended the
+        neighbors of their top rated movies. Movies the users already rated are
+        never recommended. Users left without a ranking, also when the vector
+        search is unavailable, get the popular movies.
+        """
+        with stage("user_sql"):
+            users = {
+                r.id: r
+                for r in sqldb.db_session.query(User.id, User.name, User.embedding)
+                .filter(User.id.in_(user_ids))
+                .all()
+            }
 
-        return results, 200
+        rankings = {}
+        if mode == "embedding":
+            rankings = cls.rank_by_embedding(
+                vdb,
+                seen_items,
+                {u.id: u.embedding for u in users.values() if u.embedding},
+                n,
+                params,
+            )
+        pending = [user_id for user_id in users if user_id not in rankings]
+        rankings.update(
+            cls.rank_by_seeds(sqldb, vdb, catalog, seen_items, pending, n, params)
+        )
 
-    @staticmethod
-    def get_recommendation(vdb, embedding, movie_ids):
-        query = {
-            "size": 5,
-            "query": {
-                "knn": {
-                    "vector": {
-                        "vector": embedding,
-                        "k": len(embedding),
-                    }
-                }
-            },
-        }
-        response = vdb.client.search(index=VMovie.Index.name, body=query)
+        capture("rankings", rankings)
 
-        recos = None
-        if hits := response.get("hits", {}).get("hits", {}):
-            recos = [
+        fallback = None
+        if len(rankings) < len(users):
+            fallback = cls.get_fallback(sqldb, catalog, n)
+
+        with stage("enrichment"):
+            details = {
+                movie["movie_id"]: movie
+                for movie in catalog.describe(
+                    list(dict.fromkeys(m for r in rankings.values() for m in r))
+                )
+            }
+
+        results = []
+        for user_id in user_ids:
+            if user_id not in users:
+                results.append({"msg": f"There is no user with ID {user_id}"})
+                continue
+            recommendations = (
+                [details[m] for m in rankings[user_id] if m in details]
+                if user_id in rankings
+                else fallback
+            )
+            results.append(
                 {
-                    "movie_id": hit["_source"]["movie_id"],
-                    "name": hit["_source"]["name"],
-                    "url": hit["_source"]["url"],
-                    "score": hit["_score"],
+                    "user_id": user_id,
+                    "name": users[user_id].name,
+                    "recommendations": recommendations,
                 }
-                for hit in hits
-                if hit["_source"]["movie_id"] not in movie_ids
-            ]
-        return recos[0] if len(recos) > 0 else recos
+            )
+        return results
 
     @staticmethod
-    def get_movie_stats(sqldb, movie_ids):
-        response = (
-            sqldb.db_session.query(
-                Movie.id, Movie.name, Movie.url, Movie.release_date, Movie.genres
+    def rank_by_embedding(vdb, seen_items, embeddings, n, params=None):
+        """Rank movies with a single search per user embedding.
+
+        The search over-fetches by the number of movies the user rated, up to
+        `seen.max_overfetch`, and the rated ones are filtered out afterwards.
+        """
+        max_overfetch = current_app.container.config.seen.max_overfetch()
+        user_ids = list(embeddings)
+        if not user_ids:
+            return {}
+
+        overfetch = max(
+            min(len(seen_items.seen(user_id)), max_overfetch) for user_id in user_ids
+        )
+        try:
+            hits = vdb.knn_msearch(
+                VMovie.Index.name,
+                [embeddings[user_id] for user_id in user_ids],
+                size=n + overfetch,
+                params=params,
             )
-            .filter(Movie.id.in_(movie_ids))
-            .all()
+        except VectorSearchUnavailable:
+            return {}
+
+        rankings = {}
+        for user_id, user_hits in zip(user_ids, hits):
+            ranking = seen_items.unseen(user_id, [m for m, _ in user_hits])[:n]
+            if ranking:
+                rankings[user_id] = ranking
+        return rankings
+
+    @classmethod
+    def rank_by_seeds(cls, sqldb, vdb, catalog, seen_items, user_ids, n, params=None):
+        """Rank movies by merging the neighbors of every user top rated movies.
+
+        Runs one query for the seed ratings of all the users and one batched vector
+        search for every distinct seed movie. Every seed over-fetches
+        `seen.seed_overfetch` neighbors to make up for the ones the user rated.
+        """
+        seed_overfetch = current_app.container.config.seen.seed_overfetch()
+        seeds = cls.get_seeds(sqldb, user_ids, n)
+
+        seed_ids, embeddings = catalog.embeddings(
+            list(dict.fromkeys(m for movies in seeds.values() for m in movies))
         )
+        try:
+            hits = dict(
+                zip(
+                    seed_ids.tolist(),
+                    vdb.knn_msearch(
+                        VMovie.Index.name,
+                        embeddings.tolist(),
+                        size=SEED_NEIGHBORS + seed_overfetch,
+                        params=params,
+                    ),
+                )
+            )
+        except VectorSearchUnavailable:
+            return {}
 
-        stats = [
-            {
-                "movie_id": r.id,
-                "name": r.name,
-                "url": r.url,
-                "year": r.release_date.year,
-                "genres": r.genres,
-            }
-            for r in response
-        ]
-        return stats
+        rankings = {}
+        for user_id in user_ids:
+            user_seeds = [m for m in seeds.get(user_id, []) if m in hits]
+            if not user_seeds:
+                continue
+            ranking = cls.merge_hits([hits[m] for m in user_seeds], exclude=user_seeds)
+            ranking = seen_items.unseen(user_id, ranking)[:n]
+            if ranking:
+                rankings[user_id] = ranking
+        return rankings
+
+    @classmethod
+    def get_seeds(cls, sqldb, user_ids, n):
+        """Get the top n movies that every user rated with 4 or more"""
+        if not user_ids:
+            return {}
+
+        with stage("seed_sql"):
+            response = sqldb.db_session.execute(sqldb.seeds_query(user_ids, n)).all()
+
+        seeds = {}
+        for user_id, movie_id in response:
+            seeds.setdefault(user_id, []).append(movie_id)
+        return seeds
 
     @staticmethod
-    def get_fallback(sqldb, n):
+    def merge_hits(hits_per_seed, exclude):
+        """Merge the hits of every seed query into a single ranking.
 
-        response = (
-            sqldb.db_session.query(
-                Rating.movie_id, Movie.name, Movie.url, Movie.genres, Movie.release_date
-            )
-            .group_by(
-                Rating.movie_id, Movie.name, Movie.genres, Movie.release_date, Movie.url
-            )
-            .join(Movie)
-            .having(func.count(Rating.rating) > 10)
-            .order_by(func.avg(Rating.rating).desc(), func.count(Rating.rating).desc())
-            .limit(n)
-        ).all()
-
-        stats = [
-            {
-                "movie_id": r.movie_id,
-                "name": r.name,
-                "url": r.url,
-                "year": r.release_date.year,
-                "genres": r.genres,
-            }
-            for r in response
-        ]
-        return stats
+        Movies found by more than one seed are returned once, with the scores of
+        every seed added up, so films close to several liked movies rank higher.
+        """
+        exclude = set(exclude)
+        scores = {}
+        for hits in hits_per_seed:
+            for movie_id, score in hits:
+                if movie_id in exclude:
+                    continue
+                scores[movie_id] = scores.get(movie_id, 0.0) + score
+
+        return sorted(scores, key=scores.get, reverse=True)
+
+    @staticmethod
+    def get_fallback(sqldb, catalog, n):
+        with stage("popular_sql"):
+            popular = sqldb.get_popular_movies(n)
+        with stage("enrichment"):
+            return catalog.describe(popular)
+
+
+@api.route("/users/recommendations", methods=["POST"])
+class GetUsersBatchService(Resource):
+
+    def post(self):
+        vdb = current_app.container.vector_db()
+        sqldb = current_app.container.sql_db()
+        catalog = current_app.container.catalog()
+        seen_items = current_app.container.seen_items()
+        batch_size = current_app.container.config.batch.size()
+
+        body = request.get_json(silent=True) or {}
+        user_ids = body.get("user_ids")
+        if not isinstance(user_ids, list) or not user_ids:
+            return {"msg": "The body must have a non empty list of user_ids"}, 400
+        # Everything is validated before the response starts streaming, a failure
+        # afterwards would cut it off after a 200
+        try:
+            user_ids = parse_ids(user_ids, "user_ids")
+            n = parse_count(body.get("n", 5), "n")
+            overrides = parse_search_overrides(body)
+        except ValueError as error:
+            return {"msg": str(error)}, 400
+        mode = body.get("mode", current_app.container.config.users.mode())
+        if mode not in MODES:
+            return {"msg": f"The mode must be one of {', '.join(MODES)}"}, 400
+        params = SearchParams.from_config(
+            current_app.container.config.search.user(), overrides
+        )
+
+        # Users are processed in batches and every result is sent as a JSON line as
+        # soon as its batch is ready, so big requests never sit in memory at once.
+        def generate():
+            for start in range(0, len(user_ids), batch_size):
+                batch = user_ids[start : start + batch_size]
+                try:
+                    results = GetUserService.recommend(
+                        sqldb, vdb, catalog, seen_items, batch, n, mode, params
+                    )
+                except InvalidVectorSearch as error:
+                    # The status is already sent, the users of the batch get the error
+                    results = [{"user_id": u, "msg": str(error)} for u in batch]
+                with stage("serialization"):
+                    lines = "".join(json.dumps(result) + "\n" for result in results)
+                yield lines
+
+        return Response(
+            stream_with_context(generate()), mimetype="application/x-ndjson"
+        )
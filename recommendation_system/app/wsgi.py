@@ -0,0 +1,5 @@
+"""WSGI entry point used by gunicorn"""
+
+from app import create_app
+
+app = create_app()
@@ -0,0 +1 @@
+"""Load testing tools for the recommendation API"""
@@ -0,0 +1,160 @@
+"""In-process stand-in for the OpenSearch k-NN API.
+
+The fake client answers the `msearch` requests built by the OpenSearch backends
+with an exact search over the NumPy embedding files, so the benchmarks go through
+the same query building and response parsing code as production.
+"""
+
+import asyncio
+import random
+import time
+
+from core.services.database.vector_backends import (
+    ASYNC_BACKENDS,
+    BACKENDS,
+    AsyncOpenSearchBackend,
+    NumpyBackend,
+    OpenSearchBackend,
+)
+from opensearchpy.exceptions import ConnectionTimeout
+
+
+class FakeOpenSearch:
+    """Answer k-NN `msearch` bodies from NumPy indexes.
+
+    :param indexes: NumpyBackend holding an index per OpenSearch index name.
+    :param latency_ms: delay added to every request, to emulate the network hop.
+    :param spike_rate: fraction of the requests delayed `spike_ms` more, to emulate
+        a node in a GC pause or with a slow shard.
+    """
+
+    def __init__(self, indexes, latency_ms=0, spike_rate=0, spike_ms=0):
+        self.indexes = indexes
+        self.latency_ms = latency_ms
+        self.spike_rate = spike_rate
+        self.spike_ms = spike_ms
+
+    def msearch(self, body, request_timeout=None):
+        latency = self.latency()
+        if request_timeout and latency > request_timeout:
+            time.sleep(request_timeout)
+            raise self.timeout_error(request_timeout)
+        if latency:
+            time.sleep(latency)
+        return self.search(body)
+
+    def latency(self):
+        """Seconds the next request takes to answer"""
+        spike = self.spike_ms if random.random() < self.spike_rate else 0
+        return (self.latency_ms + spike) / 1000
+
+    @staticmethod
+    def timeout_error(request_timeout):
+        return ConnectionTimeout(
+            "TIMEOUT", f"Read timed out. (read timeout={request_timeout})", None
+        )
+
+    def search(self, body):
+        start = time.perf_counter()
+        responses = [
+            self.knn_search(header["index"], query)
+            for header, query in zip(body[::2], body[1::2])
+        ]
+        return {
+            "took": int((time.perf_counter() - start) * 1000),
+            "responses": responses,
+        }
+
+    def knn_search(self, index, query):
+        if "filter" in self.knn_clause(query["query"]):
+            # The fake has no document fields to evaluate filters on
+            return {"status": 400, "error": {"type": "filter_not_supported"}}
+        vector, k, exclude = self.parse_query(query["query"])
+        # Like the k-NN plugin, keep the k nearest first and filter them afterwards
+        hits = self.indexes.knn_msearch(index, [vector], k)[0]
+        hits = [hit for hit in hits if hit[0] not in exclude][: query["size"]]
+        return {
+            "took": 0,
+            "hits": {
+                "hits": [
+                    {"_index": index, "_id": str(doc_id), "_score": score}
+                    for doc_id, score in hits
+                ]
+            },
+        }
+
+    @staticmethod
+    def knn_clause(query):
+        if "bool" in query:
+            query = query["bool"]["must"][0]
+        return query["knn"]["vector"]
+
+    @classmethod
+    def parse_query(cls, query):
+        """Return the vector, the number of candidates and the excluded ids"""
+        exclude = set()
+        if "bool" in query:
+            for clause in query["bool"].get("must_not", []):
+                exclude.update(int(i) for i in clause["ids"]["values"])
+        knn = cls.knn_clause(query)
+        return knn["vector"], knn["k"], exclude
+
+
+class AsyncFakeOpenSearch(FakeOpenSearch):
+
+    async def msearch(self, body, request_timeout=None):
+        latency = self.latency()
+        if request_timeout and latency > request_timeout:
+            await asyncio.sleep(request_timeout)
+            raise self.timeout_error(request_timeout)
+        if latency:
+            await asyncio.sleep(latency)
+        return self.search(body)
+
+    async def close(self):
+        pass
+
+
+class FakeClientsMixin:
+    """Make the clients of an OpenSearch backend FakeOpenSearch instances.
+
+    It reads the `numpy` indexes of the configuration, `fake_latency_ms`,
+    `fake_spike_rate` and `fake_spike_ms`. With hedging every node gets its own
+    fake, with the same indexes and latencies.
+    """
+
+    fake_class = FakeOpenSearch
+
+    def __init__(self, config):
+        self.indexes = NumpyBackend(config)
+        super().__init__(config)
+
+    def make_client(self, config, hosts):
+        return self.fake_class(
+            self.indexes,
+            latency_ms=config.get("fake_latency_ms", 0),
+            spike_rate=config.get("fake_spike_rate", 0),
+            spike_ms=config.get("fake_spike_ms", 0),
+        )
+
+    def pool_stats(self):
+        if self.hedger is None:
+            return None
+        return [
+            {"host": host, **stats}
+            for host, stats in self.hedger.tracker.stats().items()
+        ]
+
+
+class FakeOpenSearchBackend(FakeClientsMixin, OpenSearchBackend):
+    pass
+
+
+class AsyncFakeOpenSearchBackend(FakeClientsMixin, AsyncOpenSearchBackend):
+    fake_class = AsyncFakeOpenSearch
+
+
+def register_fake_backends():
+    """Make the fake available as the `fake_opensearch` vector backend"""
+    BACKENDS["fake_opensearch"] = FakeOpenSearchBackend
+    ASYNC_BACKENDS["fake_opensearch"] = AsyncFakeOpenSearchBackend
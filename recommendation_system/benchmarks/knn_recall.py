@@ -0,0 +1,94 @@
+"""Measure the recall and the latency of the k-NN search across search params.
+
+Every combination of `--num-candidates` and `--ef-search` runs the same sample
+of queries against the vector backend of the configuration. The hits are compared
+with an exact search over the NumPy embedding files of its `numpy` section, so
+recall@k is the fraction of the true k nearest neighbors that were returned.
+
+Run it from the recommendation_system folder, with CONFIG_PATH set as for the app:
+    PYTHONPATH=. python -m benchmarks.knn_recall --num-candidates 10,50,100 --ef-search none,64,256
+"""
+
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+from benchmarks.fake_opensearch import register_fake_backends
+from core.services.configuration import ConfigurationManager
+from core.services.database import SearchParams, VectorDBService
+from core.services.database.vector_backends import NumpyBackend
+
+
+def int_list(value):
+    return [None if v.lower() == "none" else int(v) for v in value.split(",")]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--index", default="movie")
+    parser.add_argument("--k", type=int, default=10, help="Results of every search")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--num-candidates", type=int_list, default=[None])
+    parser.add_argument("--ef-search", type=int_list, default=[None])
+    parser.add_argument(
+        "--backend", help="Vector backend, the configured one if not set"
+    )
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", help="Optional JSON file for the results")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = ConfigurationManager.init_config()["elastic"]
+    register_fake_backends()
+    vdb = VectorDBService({**config, "backend": args.backend or config["backend"]})
+    exact = NumpyBackend(config)
+
+    ids, matrix = exact.indexes[args.index]
+    rng = np.random.default_rng(args.random_seed)
+    rows = rng.choice(len(ids), size=min(args.queries, len(ids)), replace=False)
+    queries = np.asarray(matrix[rows]).tolist()
+    truth = exact.knn_msearch(args.index, queries, args.k)
+
+    results = []
+    for num_candidates, ef_search in itertools.product(
+        args.num_candidates, args.ef_search
+    ):
+        params = SearchParams(num_candidates=num_candidates, ef_search=ef_search)
+        latencies, recalls = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            hits = vdb.knn_search(args.index, query, args.k, params=params)
+            latencies.append((time.perf_counter() - start) * 1000)
+            expected = {doc_id for doc_id, _ in expected}
+            recalls.append(
+                len(expected & {doc_id for doc_id, _ in hits}) / len(expected)
+            )
+
+        results.append(
+            {
+                "num_candidates": num_candidates,
+                "ef_search": ef_search,
+                "recall": float(np.mean(recalls)),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+            }
+        )
+        print(
+            f"num_candidates={num_candidates} ef_search={ef_search}: "
+            f"recall@{args.k} {results[-1]['recall']:.3f}  "
+            f"p50 {results[-1]['p50_ms']:.2f}ms  p95 {results[-1]['p95_ms']:.2f}ms  "
+            f"p99 {results[-1]['p99_ms']:.2f}ms"
+        )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"parameters": vars(args), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
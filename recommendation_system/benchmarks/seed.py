@@ -0,0 +1,75 @@
+"""Seed a scratch database and the embedding files used by the benchmarks.
+
+The tables are loaded from the `tp_integrador_de_python` CSV files with the
+regular loader. Embeddings are random, but seeded, so every run serves the same
+recommendations: the benchmarks measure serving, not model quality.
+"""
+
+import contextlib
+import logging
+import os
+import pickle
+import sys
+
+import numpy as np
+from core.services.database import Movie, User
+from core.services.database.models import KNN_VECTOR_DIMENSION
+from sqlalchemy import select, update
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def import_data_script(name):
+    """Import one of the scripts of the data folder, which are not a package"""
+    if DATA_DIR not in sys.path:
+        sys.path.insert(0, DATA_DIR)
+    return __import__(name)
+
+
+def seed(sqldb, files_dir, workdir, seed=0):
+    """Load the CSV files in the database and create random embeddings.
+
+    The tables are dropped first, never point it to a database with real data.
+    """
+    logger.info(f"Loading {files_dir} into the database")
+    with working_directory(files_dir):
+        import_data_script("load_data").load_data()
+
+    rng = np.random.default_rng(seed)
+    for model, name in ((Movie, "movie"), (User, "user")):
+        ids = sqldb.db_session.execute(select(model.id).order_by(model.id)).scalars()
+        ids = np.fromiter(ids, dtype=np.int64)
+        embeddings = rng.normal(size=(len(ids), KNN_VECTOR_DIMENSION))
+        embeddings = embeddings.astype(np.float32)
+
+        np.save(os.path.join(workdir, f"{name}_embeddings_matrix.npy"), embeddings)
+        with open(os.path.join(workdir, f"{name}2Idx.pkl"), "wb") as file:
+            pickle.dump({i: row for row, i in enumerate(ids.tolist())}, file)
+
+        sqldb.db_session.execute(
+            update(model),
+            [
+                {"id": i, "embedding": vector}
+                for i, vector in zip(ids.tolist(), embeddings.tolist())
+            ],
+        )
+        sqldb.db_session.commit()
+        logger.info(f"Created {len(ids)} {name} embeddings")
+
+    version = sqldb.add_embedding_version()
+    with working_directory(workdir):
+        import_data_script("build_neighbors").build_neighbors(embedding_version=version)
+    sqldb.db_session.remove()
+    return version
@@ -0,0 +1,6 @@
+"""Init file for the cache service"""
+
+from core.services.cache.lru_cache import LRUCache
+from core.services.cache.single_flight import AsyncSingleFlight, SingleFlight
+
+__all__ = ["LRUCache", "SingleFlight", "AsyncSingleFlight"]
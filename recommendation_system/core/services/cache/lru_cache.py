@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+from core.services.metrics import observe_cache
+from flask_caching.backends.base import BaseCache
+
+
+class LRUCache(BaseCache):
+    """Thread safe in-memory cache with per-entry TTL and LRU eviction.
+
+    Values are stored as they are, without pickling, so callers must not mutate
+    what they get from the cache.
+
+    :param threshold: maximum number of entries kept before evicting the least
+                      recently used ones.
+    :param default_timeout: default TTL in seconds. 0 means entries never expire.
+    :param stale_timeout: seconds an expired entry is still kept, for `lookup` to
+                          return it as stale while it is computed again.
+    """
+
+    def __init__(self, threshold=1024, default_timeout=300, stale_timeout=0):
+        super().__init__(default_timeout=default_timeout)
+        self.threshold = threshold
+        self.stale_timeout = stale_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            dict(
+                threshold=config["CACHE_THRESHOLD"],
+                stale_timeout=config.get("CACHE_STALE_TIMEOUT", 0),
+            )
+        )
+        return cls(*args, **kwargs)
+
+    def _expiration(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.monotonic() + timeout if timeout > 0 else None
+
+    def _get_entry(self, key):
+        """Return the `(expires, value)` entry of the key, None once it is too stale"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, _ = entry
+        if expires is not None and expires + self.stale_timeout <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def _fresh(entry):
+        expires, _ = entry
+        return expires is None or expires > time.monotonic()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._get_entry(key)
+        if entry is not None and not self._fresh(entry):
+            entry = None
+        observe_cache("hit" if entry else "miss")
+        return entry[1] if entry else None
+
+    def lookup(self, key):
+        """Return the `(value, fresh)` tuple of the key, None if missing.
+
+        Unlike `get`, expired values are returned, as not fresh, for
+        `stale_timeout` seconds.
+        """
+        with self._lock:
+            entry = self._get_entry(key)
+        if entry is None:
+            observe_cache("miss")
+            return None
+        fresh = self._fresh(entry)
+        observe_cache("hit" if fresh else "stale")
+        return entry[1], fresh
+
+    def has(self, key):
+        with self._lock:
+            entry = self._get_entry(key)
+            return entry is not None and self._fresh(entry)
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._entries[key] = (self._expiration(timeout), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            entry = self._get_entry(key)
+            if entry is not None and self._fresh(entry):
+                return False
+        return self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
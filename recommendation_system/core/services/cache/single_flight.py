@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run a function once for all the threads asking for the same key at once.
+
+    The first caller of a key runs the function; the ones arriving while it runs
+    wait and get its result, or its exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def running(self, key):
+        return key in self._calls
+
+    def do(self, key, fn):
+        """Return the result of `fn()` and whether it was computed by another caller"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines, to be used from a single event loop.
+
+    The computation runs as a task, so it carries on for the callers still
+    waiting when the one that started it is cancelled.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def running(self, key):
+        return key in self._calls
+
+    async def do(self, key, fn):
+        """Return the result of `await fn()` and whether it was computed by another
+        caller
+        """
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task), not leader
@@ -0,0 +1,5 @@
+"""Init file for the catalog service"""
+
+from core.services.catalog.movie_catalog import MovieCatalog
+
+__all__ = ["MovieCatalog"]
@@ -0,0 +1,268 @@
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+from core.services.database import Movie, SearchFilter, VMovie
+from sqlalchemy import select, tuple_
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogColumns(NamedTuple):
+    """Columnar snapshot of the movies table, rows sorted by movie id"""
+
+    ids: np.ndarray  # int32
+    names: np.ndarray  # object
+    urls: np.ndarray  # object
+    years: np.ndarray  # int16
+    genres: np.ndarray  # uint64 bitmask over `genre_names`
+    genre_names: tuple
+    embeddings: np.ndarray  # float32, NaN rows for movies without embedding
+
+
+class MovieCatalog:
+    """Read-through in-memory copy of the movies the recommendation endpoints return.
+
+    The whole table is loaded once and then refreshed incrementally with the rows
+    created or updated since the last load, read with an `(updated_at, id)` cursor.
+    New embedding versions trigger a full reload.
+    Snapshots are immutable and swapped atomically, so readers never lock.
+    """
+
+    def __init__(self, sqldb, refresh_interval=60):
+        self.sqldb = sqldb
+        self.refresh_interval = refresh_interval
+        self.columns = None
+        self.high_water = None
+        self._missing = set()
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self, *args):
+        """Load the whole catalog, replacing the current snapshot"""
+        with self._lock:
+            rows = self._fetch()
+            self.columns = self._build(rows)
+            self.high_water = self._cursor(rows)
+            self._missing = set()
+            self._last_refresh = time.monotonic()
+        logger.info(f"Movie catalog loaded with {len(self.columns.ids)} movies")
+
+    def maybe_refresh(self):
+        """Add the movies created or updated since the last refresh, at most every
+        interval
+        """
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_refresh = time.monotonic()
+            # Every row of a load shares its updated_at, the id breaks the tie so
+            # the rows already merged are not fetched again
+            condition = (
+                tuple_(Movie.updated_at, Movie.id) > tuple_(*self.high_water)
+                if self.high_water is not None
+                else None
+            )
+            rows = self._fetch(condition)
+            if rows:
+                self._merge(rows)
+                self.high_water = max(
+                    (c for c in (self._cursor(rows), self.high_water) if c),
+                    default=None,
+                )
+            self._missing = set()
+        except Exception:
+            logger.exception("Could not refresh the movie catalog")
+        finally:
+            self._lock.release()
+
+    def get(self, movie_id):
+        """Return the movie details or None if the movie does not exist"""
+        movies = self.describe([movie_id])
+        return movies[0] if movies else None
+
+    def describe(self, movie_ids):
+        """Return the details of the given movies, keeping their order.
+
+        Unknown ids are looked up in the database once and skipped if missing.
+        """
+        columns = self._read_through(movie_ids)
+        rows = self._rows(columns, movie_ids)
+        return [
+            {
+                "movie_id": int(columns.ids[row]),
+                "name": columns.names[row],
+                "url": columns.urls[row],
+                "year": int(columns.years[row]),
+                "genres": self._genres(columns, columns.genres[row]),
+            }
+            for row in rows
+            if row >= 0
+        ]
+
+    def embedding(self, movie_id):
+        """Return the movie embedding as a list, None if it has none"""
+        columns = self._read_through([movie_id])
+        row = self._rows(columns, [movie_id])[0]
+        if row < 0 or not columns.embeddings.shape[1]:
+            return None
+        vector = columns.embeddings[row]
+        return None if np.isnan(vector).any() else vector.tolist()
+
+    def embeddings(self, movie_ids):
+        """Return the embeddings of the given movies that have one, as `(ids, matrix)`"""
+        columns = self._read_through(movie_ids)
+        rows = self._rows(columns, movie_ids)
+        rows = rows[rows >= 0]
+        if not columns.embeddings.shape[1]:
+            return columns.ids[:0], columns.embeddings[:0]
+        rows = rows[~np.isnan(columns.embeddings[rows]).any(axis=1)]
+        return columns.ids[rows], columns.embeddings[rows]
+
+    def search_filter(self, genres=None, year_from=None, year_to=None):
+        """Return the SearchFilter of the movies with any of `genres` released
+        between `year_from` and `year_to`, or None without any constraint.
+        """
+        if not genres and year_from is None and year_to is None:
+            return None
+
+        columns = self.columns
+        matches = np.ones(len(columns.ids), dtype=bool)
+        if genres:
+            bits = {name: 1 << bit for bit, name in enumerate(columns.genre_names)}
+            mask = np.uint64(sum(bits.get(genre, 0) for genre in set(genres)))
+            matches &= (columns.genres & mask) != 0
+        if year_from is not None:
+            matches &= columns.years >= year_from
+        if year_to is not None:
+            matches &= columns.years <= year_to
+        return SearchFilter(
+            query=VMovie.filter_query(genres, year_from, year_to),
+            ids=columns.ids[matches].astype(np.int64),
+        )
+
+    @staticmethod
+    def _rows(columns, movie_ids):
+        """Vectorized lookup of the catalog rows, -1 for unknown ids"""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        if not len(columns.ids):
+            return np.full(len(movie_ids), -1)
+        rows = np.searchsorted(columns.ids, movie_ids)
+        rows = np.minimum(rows, len(columns.ids) - 1)
+        return np.where(columns.ids[rows] == movie_ids, rows, -1)
+
+    @staticmethod
+    def _genres(columns, mask):
+        return [
+            name for bit, name in enumerate(columns.genre_names) if int(mask) >> bit & 1
+        ]
+
+    def _read_through(self, movie_ids):
+        columns = self.columns
+        rows = self._rows(columns, movie_ids)
+        unknown = {
+            int(movie_id)
+            for movie_id, row in zip(movie_ids, rows)
+            if row < 0 and int(movie_id) not in self._missing
+        }
+        if not unknown:
+            return columns
+
+        with self._lock:
+            rows = self._fetch(Movie.id.in_(unknown))
+            self._missing |= unknown - {r.id for r in rows}
+            if rows:
+                self._merge(rows)
+        return self.columns
+
+    @staticmethod
+    def _cursor(rows):
+        """Return the largest `(updated_at, id)` of `rows`, None without any"""
+        return max(
+            ((r.updated_at, r.id) for r in rows if r.updated_at is not None),
+            default=None,
+        )
+
+    def _fetch(self, condition=None):
+        stmt = select(
+            Movie.id,
+            Movie.name,
+            Movie.url,
+            Movie.release_date,
+            Movie.genres,
+            Movie.embedding,
+            Movie.updated_at,
+        )
+        if condition is not None:
+            stmt = stmt.where(condition)
+        with self.sqldb.engine.connect() as conn:
+            return conn.execute(stmt).all()
+
+    def _merge(self, rows):
+        """Add or replace rows in a new snapshot. Must be called holding the lock"""
+        columns = self.columns
+        new_ids = {r.id for r in rows}
+        kept = [
+            (
+                int(columns.ids[i]),
+                columns.names[i],
+                columns.urls[i],
+                int(columns.years[i]),
+                self._genres(columns, columns.genres[i]),
+                columns.embeddings[i] if columns.embeddings.shape[1] else None,
+            )
+            for i in range(len(columns.ids))
+            if int(columns.ids[i]) not in new_ids
+        ]
+        added = [
+            (
+                r.id,
+                r.name,
+                r.url,
+                r.release_date.year,
+                r.genres or [],
+                r.embedding,
+            )
+            for r in rows
+        ]
+        self.columns = self._columns(kept + added)
+
+    @classmethod
+    def _build(cls, rows):
+        return cls._columns(
+            [
+                (r.id, r.name, r.url, r.release_date.year, r.genres or [], r.embedding)
+                for r in rows
+            ]
+        )
+
+    @staticmethod
+    def _columns(records):
+        records = sorted(records, key=lambda r: r[0])
+        genre_names = tuple(sorted({g for r in records for g in r[4]}))
+        genre_bits = {name: 1 << bit for bit, name in enumerate(genre_names)}
+
+        dimension = next(
+            (len(r[5]) for r in records if r[5] is not None and len(r[5])), 0
+        )
+        embeddings = np.full((len(records), dimension), np.nan, dtype=np.float32)
+        for i, r in enumerate(records):
+            if dimension and r[5] is not None and len(r[5]) == dimension:
+                embeddings[i] = r[5]
+
+        return CatalogColumns(
+            ids=np.array([r[0] for r in records], dtype=np.int32),
+            names=np.array([r[1] for r in records], dtype=object),
+            urls=np.array([r[2] for r in records], dtype=object),
+            years=np.array([r[3] for r in records], dtype=np.int16),
+            genres=np.array(
+                [sum(genre_bits[g] for g in r[4]) for r in records], dtype=np.uint64
+            ),
+            genre_names=genre_names,
+            embeddings=embeddings,
+        )
@@ -1,13 +1,45 @@
+from core.services.database.async_database_service import AsyncDatabaseService
 from core.services.database.database_service import DatabaseService
-from core.services.database.models import Movie, Rating, User, VMovie, VUser
-from core.services.database.vectordb_service import VectorDBService
+from core.services.database.models import (
+    EmbeddingVersion,
+    LoadCheckpoint,
+    Movie,
+    MoviePopularity,
+    Rating,
+    User,
+    VMovie,
+    VUser,
+)
+from core.services.database.vector_backends import (
+    CatalogBackend,
+    SearchFilter,
+    SearchParams,
+)
+from core.services.database.vectordb_service import (
+    AsyncVectorDBService,
+    InvalidVectorSearch,
+    VectorDBService,
+    VectorSearchUnavailable,
+)
+from core.services.database.version_watcher import EmbeddingVersionWatcher
 
 __all__ = [
     "DatabaseService",
     "VectorDBService",
+    "AsyncDatabaseService",
+    "AsyncVectorDBService",
+    "SearchParams",
+    "SearchFilter",
+    "CatalogBackend",
+    "VectorSearchUnavailable",
+    "InvalidVectorSearch",
+    "EmbeddingVersionWatcher",
+    "EmbeddingVersion",
+    "LoadCheckpoint",
     "User",
     "Movie",
     "Rating",
+    "MoviePopularity",
     "VMovie",
     "VUser",
 ]
@@ -0,0 +1,35 @@
+from core.services.database.database_service import DatabaseService, database_url
+from core.services.database.pool import InstrumentedAsyncQueuePool, pool_options
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+class AsyncDatabaseService:
+    """Asyncio counterpart of the DatabaseService used by the async endpoints.
+
+    It only runs queries, the tables are created by the DatabaseService.
+    """
+
+    def __init__(self, config):
+
+        self.engine = create_async_engine(
+            database_url(config, driver="asyncpg"),
+            poolclass=InstrumentedAsyncQueuePool,
+            **pool_options(config),
+        )
+
+    def pool_stats(self):
+        """Return the live usage statistics of the connection pool"""
+        return self.engine.pool.stats()
+
+    async def execute(self, statement):
+        """Run `statement` on its own pooled connection and return all the rows"""
+        async with self.engine.connect() as conn:
+            return (await conn.execute(statement)).all()
+
+    async def get_popular_movies(self, n, min_ratings=10):
+        """Return the ids of the best rated movies with more than `min_ratings`"""
+        rows = await self.execute(DatabaseService.popular_movies_query(n, min_ratings))
+        return [r.movie_id for r in rows]
+
+    async def close(self):
+        await self.engine.dispose()
@@ -0,0 +1,193 @@
+"""Bulk loading of DataFrames into Postgres with COPY"""
+
+import contextlib
+import hashlib
+import io
+import logging
+import time
+
+import pandas as pd
+from sqlalchemy import ARRAY, column, inspect, select, table, text
+from sqlalchemy.dialects.postgresql import insert
+
+logger = logging.getLogger(__name__)
+
+# Rows serialized into the COPY buffer at once, so big frames are never written
+# to memory as a whole
+COPY_CHUNK_ROWS = 100_000
+
+
+def pg_array(values):
+    """Format a list as a Postgres array literal, with every element quoted"""
+    elements = (
+        '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+        for value in values
+    )
+    return "{" + ",".join(elements) + "}"
+
+
+def content_hash(frame, columns):
+    """Return the md5 of the `columns` of every row, to tell the changed rows apart"""
+    joined = pd.Series("", index=frame.index)
+    for name in columns:
+        joined = joined + "\x1f" + frame[name].astype(str)
+    return joined.map(lambda row: hashlib.md5(row.encode()).hexdigest())
+
+
+def copy_dataframe(connection, table, frame, chunk_rows=COPY_CHUNK_ROWS, into=None):
+    """Stream the rows of `frame` into `table` with `COPY FROM STDIN`.
+
+    :param connection: psycopg2 connection, the caller commits.
+    :param table: SQLAlchemy Table, the frame columns must be columns of it.
+    :param frame: DataFrame with the rows. Missing values are loaded as NULL, empty
+        strings stay empty.
+    :param into: name of the table to copy into when it is not `table`, such as a
+        staging table with the same columns.
+    :return: the number of rows copied.
+    """
+    frame = frame.copy()
+    for name in frame.columns:
+        if isinstance(table.columns[name].type, ARRAY):
+            frame[name] = frame[name].map(
+                lambda values: None if values is None else pg_array(values)
+            )
+
+    columns = ", ".join(f'"{name}"' for name in frame.columns)
+    statement = (
+        f"COPY {into or table.name} ({columns}) "
+        "FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(frame), chunk_rows):
+            buffer = io.StringIO()
+            frame.iloc[start : start + chunk_rows].to_csv(
+                buffer, header=False, index=False, na_rep=r"\N"
+            )
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+    return len(frame)
+
+
+def upsert_dataframe(conn, target, frame, keep=("created_at",)):
+    """Insert the new rows of `frame` and update the ones whose content hash changed.
+
+    The rows are copied into a temporary table, then merged into `target` with one
+    `INSERT ... ON CONFLICT DO UPDATE` that leaves the unchanged rows untouched.
+    When the primary key also holds a partition column, as in the partitioned
+    ratings, a row whose partition column changed is deleted and inserted again,
+    so it is counted as updated and never kept twice.
+
+    :param conn: SQLAlchemy connection, the staging table lives in its transaction.
+    :param target: SQLAlchemy Table with a `content_hash` column.
+    :param frame: DataFrame with the primary key and `content_hash` columns.
+    :param keep: columns that are only written when the row is inserted. The
+        others, such as `updated_at`, are also written when the row changed.
+    :return: the number of inserted and updated rows.
+    """
+    stage = f"{target.name}_stage"
+    conn.execute(text(f"CREATE TEMP TABLE {stage} (LIKE {target.name}) ON COMMIT DROP"))
+    copy_dataframe(conn.connection, target, frame, into=stage)
+
+    names = list(frame.columns)
+    # The primary key of a partitioned table also holds the partition column
+    key = inspect(conn).get_pk_constraint(target.name)["constrained_columns"]
+    moved = 0
+    if "id" in key and len(key) > 1:
+        changed_partition = " OR ".join(
+            f"t.{name} IS DISTINCT FROM s.{name}" for name in key if name != "id"
+        )
+        moved = conn.execute(
+            text(
+                f"DELETE FROM {target.name} t USING {stage} s "
+                f"WHERE t.id = s.id AND ({changed_partition})"
+            )
+        ).rowcount
+    statement = insert(target).from_select(
+        names, select(table(stage, *(column(name) for name in names)))
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=key,
+        set_={
+            name: statement.excluded[name]
+            for name in names
+            if name not in keep and name not in key
+        },
+        where=target.c.content_hash.is_distinct_from(statement.excluded.content_hash),
+    )
+    existing = conn.execute(
+        text(
+            f"SELECT count(*) FROM {stage} JOIN {target.name} USING ({', '.join(key)})"
+        )
+    ).scalar()
+    changed = conn.execute(statement).rowcount
+    # The moved rows were deleted before counting the existing ones
+    inserted = len(frame) - existing - moved
+    conn.execute(text(f"DROP TABLE {stage}"))
+    return inserted, changed - inserted
+
+
+@contextlib.contextmanager
+def deferred_indexes(engine, tables):
+    """Drop the secondary indexes of `tables` and create them again on exit.
+
+    Building an index once over the loaded rows is much cheaper than updating it
+    for every row. Primary keys are kept, foreign keys need them.
+    """
+    indexes = [index for table in tables for index in table.indexes]
+    for index in indexes:
+        index.drop(bind=engine, checkfirst=True)
+    try:
+        yield
+    finally:
+        for index in indexes:
+            start = time.perf_counter()
+            index.create(bind=engine, checkfirst=True)
+            logger.info(
+                f"Index {index.name} built in {time.perf_counter() - start:.2f}s"
+            )
+
+
+@contextlib.contextmanager
+def disabled_triggers(engine, table):
+    """Disable the user triggers of `table`, such as the popularity one, meanwhile.
+
+    Whatever the triggers maintain has to be rebuilt afterwards.
+    """
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table.name} DISABLE TRIGGER USER"))
+    try:
+        yield
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table.name} ENABLE TRIGGER USER"))
+
+
+def reset_sequence(engine, table, column="id"):
+    """Move the sequence of `column` past the ids loaded explicitly by COPY"""
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', '{column}'), "
+                f"COALESCE(MAX({column}), 0) + 1, false) FROM {table.name}"
+            )
+        )
+
+
+def bulk_load(engine, table, frames):
+    """Copy the DataFrames of `frames` into `table` in one transaction and log the
+    rows per second. Each frame is copied before the next one is taken, so `frames`
+    can be a generator that reads them lazily.
+    """
+    start = time.perf_counter()
+    connection = engine.raw_connection()
+    try:
+        rows = sum(copy_dataframe(connection, table, frame) for frame in frames)
+        connection.commit()
+    finally:
+        connection.close()
+    seconds = time.perf_counter() - start
+    logger.info(
+        f"Copied {rows} rows into {table.name} in {seconds:.2f}s "
+        f"({rows / max(seconds, 1e-9):,.0f} rows/s)"
+    )
+    return rows
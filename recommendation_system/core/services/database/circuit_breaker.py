@@ -0,0 +1,57 @@
+import threading
+import time
+
+
+class CircuitBreaker:
+    """Stop calling a failing dependency for a while.
+
+    After `failure_threshold` consecutive failures the breaker opens and `allow`
+    refuses every call for `reset_seconds`. Then a single trial call is let
+    through: its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=10):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        """Return whether the dependency can be called now"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_seconds or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def release(self):
+        """End a call that says nothing about the dependency health, such as an
+        invalid request, letting the next trial call through
+        """
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
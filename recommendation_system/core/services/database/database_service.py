@@ -1,23 +1,31 @@
 import os
 
-from sqlalchemy import create_engine
+from core.services.database.pool import InstrumentedQueuePool, pool_options
+from sqlalchemy import create_engine, delete, func, insert, inspect, select
 from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
 
 Base = declarative_base()
 
 
+def database_url(config, driver="psycopg2"):
+    """Build the Postgres connection url of the `sql` configuration section"""
+    user = config.get("user")
+    password = os.environ[config.get("pass")]
+    url = config.get("url")
+    port = config.get("port")
+    database = config.get("database")
+
+    return f"postgresql+{driver}://{user}:{password}@{url}:{port}/{database}"
+
+
 class DatabaseService:
 
     def __init__(self, config, drop_tables: bool = False):
 
-        user = config.get("user")
-        password = os.environ[config.get("pass")]
-        url = config.get("url")
-        port = config.get("port")
-        database = config.get("database")
-
         self.engine = create_engine(
-            f"postgresql+psycopg2://{user}:{password}@{url}:{port}/{database}"
+            database_url(config),
+            poolclass=InstrumentedQueuePool,
+            **pool_options(config),
         )
         self.db_session = scoped_session(
             sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
@@ -31,8 +39,114 @@ class DatabaseService:
         # import all modules here that might define models so that
         # they will be registered properly on the metadata.  Otherwise
         # you will have to import them first before calling init_db()
-        from core.services.database import Movie, Rating, User  # noqa
+        from core.services.database import (  # noqa
+            EmbeddingVersion,
+            LoadCheckpoint,
+            Movie,
+            MoviePopularity,
+            Rating,
+            User,
+        )
 
         if drop_tables:
             Base.metadata.drop_all(bind=engine)
+        # The popularity trigger only sees new ratings, existing ones must be aggregated
+        backfill_popularity = not inspect(engine).has_table(
+            MoviePopularity.__tablename__
+        )
         Base.metadata.create_all(bind=engine)
+        if backfill_popularity:
+            DatabaseService.refresh_popularity(engine)
+
+    def pool_stats(self):
+        """Return the live usage statistics of the connection pool"""
+        return self.engine.pool.stats()
+
+    def get_embedding_version(self):
+        """Return the id of the latest embedding load, None if there was none"""
+        from core.services.database import EmbeddingVersion
+
+        # Use its own connection so it never interferes with the request session
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.max(EmbeddingVersion.id))).scalar()
+
+    def add_embedding_version(self):
+        """Record a new embedding load so running APIs invalidate what they hold"""
+        from core.services.database import EmbeddingVersion
+
+        version = EmbeddingVersion()
+        self.db_session.add(version)
+        self.db_session.commit()
+        return version.id
+
+    @staticmethod
+    def refresh_popularity(engine):
+        """Rebuild the popularity aggregates from the whole ratings table"""
+        from core.services.database import MoviePopularity, Rating
+
+        aggregates = (
+            select(
+                Rating.movie_id,
+                func.count(Rating.rating),
+                func.sum(Rating.rating),
+                func.avg(Rating.rating),
+            )
+            .where(Rating.movie_id.is_not(None))
+            .group_by(Rating.movie_id)
+        )
+        with engine.begin() as conn:
+            conn.execute(delete(MoviePopularity))
+            conn.execute(
+                insert(MoviePopularity).from_select(
+                    ["movie_id", "rating_count", "rating_sum", "rating_mean"],
+                    aggregates,
+                )
+            )
+
+    @staticmethod
+    def popular_movies_query(n, min_ratings=10):
+        """Select the ids of the best rated movies with more than `min_ratings`"""
+        from core.services.database import MoviePopularity
+
+        return (
+            select(MoviePopularity.movie_id)
+            .where(MoviePopularity.rating_count > min_ratings)
+            .order_by(
+                MoviePopularity.rating_mean.desc(), MoviePopularity.rating_count.desc()
+            )
+            .limit(n)
+        )
+
+    @staticmethod
+    def seeds_query(user_ids, n):
+        """Select the `(user_id, movie_id)` seeds of every user, best ones first.
+
+        The seeds are the top `n` movies every user rated with 4 or more.
+        """
+        from core.services.database import Rating
+
+        ranked = (
+            select(
+                Rating.user_id,
+                Rating.movie_id,
+                func.row_number()
+                .over(
+                    partition_by=Rating.user_id,
+                    # Most recent ratings first among the ones with the same value
+                    order_by=(Rating.rating.desc(), Rating.date.desc()),
+                )
+                .label("position"),
+            )
+            .where(Rating.user_id.in_(user_ids), Rating.rating >= 4)
+            .subquery()
+        )
+        return (
+            select(ranked.c.user_id, ranked.c.movie_id)
+            .where(ranked.c.position <= n)
+            .order_by(ranked.c.user_id, ranked.c.position)
+        )
+
+    def get_popular_movies(self, n, min_ratings=10):
+        """Return the ids of the best rated movies with more than `min_ratings`"""
+        response = self.db_session.execute(self.popular_movies_query(n, min_ratings))
+        return response.scalars().all()
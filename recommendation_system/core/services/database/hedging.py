@@ -0,0 +1,300 @@
+"""Hedged requests across the nodes of a cluster.
+
+A search is sent to one node and, if it has not answered after a high percentile
+of that node's recent latencies, a duplicate goes to the next node. A node that
+fails hands the search to the next one right away. The first response wins.
+Nodes are picked with a probability inversely proportional to their median
+latency, so most of the traffic goes to the fastest one.
+"""
+
+import asyncio
+import collections
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from core.services.metrics import observe_hedge
+from opensearchpy.exceptions import ConnectionTimeout, RequestError
+
+# Latency recorded for a failed request, so failing nodes are picked less often
+FAILURE_PENALTY_SECONDS = 1.0
+
+# Smallest request timeout sent to a node, once the deadline is almost spent
+MIN_TIMEOUT_SECONDS = 0.001
+
+# Latencies a node needs before its median steers the traffic, so a single slow
+# request after a start does not starve it
+MIN_SAMPLES = 10
+
+
+class LatencyTracker:
+    """Sliding window of the latencies of every node"""
+
+    def __init__(self, nodes, window=200):
+        self.samples = {node: collections.deque(maxlen=window) for node in nodes}
+        self._lock = threading.Lock()
+
+    def record(self, node, seconds):
+        with self._lock:
+            self.samples[node].append(seconds)
+
+    def percentile(self, node, q, min_samples=1):
+        """Return the `q` percentile of the latencies of `node`, None with fewer
+        than `min_samples` of them
+        """
+        with self._lock:
+            samples = sorted(self.samples[node])
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(int(len(samples) * q / 100), len(samples) - 1)]
+
+    def order(self, rng=random):
+        """Return the nodes in the order to try them.
+
+        The first one is drawn with weights inversely proportional to the median
+        latencies, nodes with too few samples weighing as much as the fastest one.
+        The others follow from the fastest to the slowest.
+        """
+        medians = {
+            node: self.percentile(node, 50, MIN_SAMPLES) for node in self.samples
+        }
+        known = [m for m in medians.values() if m is not None]
+        fastest = min(known) if known else 1.0
+        medians = {node: fastest if m is None else m for node, m in medians.items()}
+
+        nodes = list(medians)
+        weights = [1 / max(medians[node], 1e-6) for node in nodes]
+        first = rng.choices(nodes, weights)[0]
+        return [first] + sorted(
+            (node for node in nodes if node != first), key=medians.get
+        )
+
+    def stats(self):
+        return {
+            node: {
+                "requests": len(self.samples[node]),
+                "p50_ms": _ms(self.percentile(node, 50)),
+                "p95_ms": _ms(self.percentile(node, 95)),
+            }
+            for node in self.samples
+        }
+
+
+def deadline_error(options):
+    timeout = options["request_timeout"]
+    return ConnectionTimeout(
+        "TIMEOUT", f"No node answered the search in {timeout:.3f}s", None
+    )
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class Hedger:
+    """Send `msearch` requests to one client per node, hedging the slow ones.
+
+    :param clients: dict with the client of every node, by host.
+    :param percentile: percentile of the latencies of the first node after which
+        the duplicate request is sent.
+    :param min_delay_ms: lower bound of that delay, also used while the node has
+        no latencies yet.
+    :param window: number of recent latencies kept per node.
+    :param max_workers: threads sending the requests, shared by all the searches.
+    """
+
+    def __init__(
+        self, clients, percentile=95, min_delay_ms=5, window=200, max_workers=32
+    ):
+        self.clients = clients
+        self.percentile = percentile
+        self.min_delay = min_delay_ms / 1000
+        self.tracker = LatencyTracker(clients, window)
+        self.max_workers = max_workers
+        self._executor = None
+
+    @property
+    def executor(self):
+        # Created on first use, so a forked worker never inherits its threads
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="hedge"
+            )
+        return self._executor
+
+    def delay(self, node):
+        """Seconds to wait for `node` before sending the duplicate request"""
+        return max(self.tracker.percentile(node, self.percentile) or 0, self.min_delay)
+
+    def msearch(self, body, **options):
+        """Send the search to the nodes in turn until one of them answers.
+
+        The next node gets the search once the first one is slower than its delay,
+        or right away when a node fails. `request_timeout` bounds the whole search,
+        every node is sent the time left.
+        """
+        deadline = self.deadline(options)
+        nodes = iter(self.tracker.order())
+        first = next(nodes)
+        futures = {self.submit(first, body, options, deadline): first}
+        hedge_at = time.monotonic() + self.delay(first)
+
+        # A thread can not be interrupted, so a losing request runs to completion
+        # and only its latency is kept
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=self.wait_timeout(hedge_at, deadline),
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if futures[future] != first:
+                        observe_hedge("won")
+                    return future.result()
+                error = future.exception()
+                if isinstance(error, RequestError):
+                    # Every node rejects an invalid search the same way
+                    for other in pending:
+                        other.cancel()
+                    raise error
+                node = next(nodes, None)
+                if node is not None:
+                    future = self.submit(node, body, options, deadline)
+                    futures[future] = node
+                    pending.add(future)
+
+            if self.expired(deadline) and pending:
+                for other in pending:
+                    other.cancel()
+                raise deadline_error(options)
+            if not done and hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                node = next(nodes, None)
+                if node is not None:
+                    future = self.submit(node, body, options, deadline)
+                    futures[future] = node
+                    pending.add(future)
+                    observe_hedge("sent")
+        raise error
+
+    def submit(self, node, body, options, deadline):
+        return self.executor.submit(
+            self.timed, node, body, self.node_options(options, deadline)
+        )
+
+    @staticmethod
+    def deadline(options):
+        """`time.monotonic()` the search has to answer by, None without a timeout"""
+        timeout = options.get("request_timeout")
+        return None if timeout is None else time.monotonic() + timeout
+
+    @staticmethod
+    def expired(deadline):
+        return deadline is not None and time.monotonic() >= deadline
+
+    @staticmethod
+    def node_options(options, deadline):
+        """Options of the request to a node, with the time left as its timeout"""
+        if deadline is None:
+            return options
+        left = max(deadline - time.monotonic(), MIN_TIMEOUT_SECONDS)
+        return {**options, "request_timeout": left}
+
+    @staticmethod
+    def wait_timeout(hedge_at, deadline):
+        """Seconds to wait for a response before sending the hedge or giving up"""
+        until = [t for t in (hedge_at, deadline) if t is not None]
+        return max(min(until) - time.monotonic(), 0) if until else None
+
+    def timed(self, node, body, options):
+        start = time.perf_counter()
+        try:
+            response = self.clients[node].msearch(body=body, **options)
+        except RequestError:
+            # The node answered, the search was invalid
+            self.tracker.record(node, time.perf_counter() - start)
+            raise
+        except Exception:
+            self.tracker.record(node, FAILURE_PENALTY_SECONDS)
+            raise
+        self.tracker.record(node, time.perf_counter() - start)
+        return response
+
+
+class AsyncHedger(Hedger):
+    """Hedger for asyncio clients, the losing request is cancelled"""
+
+    async def msearch(self, body, **options):
+        deadline = self.deadline(options)
+        nodes = iter(self.tracker.order())
+        first = next(nodes)
+        tasks = {self.submit(first, body, options, deadline): first}
+        hedge_at = time.monotonic() + self.delay(first)
+        try:
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.wait_timeout(hedge_at, deadline),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] != first:
+                            observe_hedge("won")
+                        return task.result()
+                    error = task.exception()
+                    if isinstance(error, RequestError):
+                        # Every node rejects an invalid search the same way
+                        raise error
+                    node = next(nodes, None)
+                    if node is not None:
+                        task = self.submit(node, body, options, deadline)
+                        tasks[task] = node
+                        pending.add(task)
+
+                if self.expired(deadline) and pending:
+                    raise deadline_error(options)
+                if not done and hedge_at is not None and time.monotonic() >= hedge_at:
+                    hedge_at = None
+                    node = next(nodes, None)
+                    if node is not None:
+                        task = self.submit(node, body, options, deadline)
+                        tasks[task] = node
+                        pending.add(task)
+                        observe_hedge("sent")
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def submit(self, node, body, options, deadline):
+        return asyncio.ensure_future(
+            self.timed(node, body, self.node_options(options, deadline))
+        )
+
+    async def timed(self, node, body, options):
+        start = time.perf_counter()
+        try:
+            response = await self.clients[node].msearch(body=body, **options)
+        except asyncio.CancelledError:
+            # The node took at least this long, a lower bound of its latency
+            self.tracker.record(node, time.perf_counter() - start)
+            raise
+        except RequestError:
+            self.tracker.record(node, time.perf_counter() - start)
+            raise
+        except Exception:
+            self.tracker.record(node, FAILURE_PENALTY_SECONDS)
+            raise
+        self.tracker.record(node, time.perf_counter() - start)
+        return response
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
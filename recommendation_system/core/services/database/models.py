@@ -2,7 +2,19 @@ import datetime
 
 from core.services.database.database_service import Base
 from opensearchpy import Date, Document, Field, Keyword, Text
-from sqlalchemy import ARRAY, Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy import (
+    ARRAY,
+    DDL,
+    Column,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    event,
+    text,
+)
 from sqlalchemy.orm import relationship
 
 KNN_VECTOR_DIMENSION = (
@@ -20,7 +32,11 @@ class User(Base):
     occupation = Column(String(255), nullable=False)
     active_since = Column(DateTime, nullable=False)
     embedding = Column(ARRAY(Float(50)), nullable=True)
-    created_at = Column(DateTime, default=datetime.datetime.now())
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(
+        DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now
+    )
+    content_hash = Column(String(32), nullable=True)
     rating = relationship("Rating")
 
 
@@ -32,7 +48,11 @@ class Movie(Base):
     release_date = Column(DateTime, nullable=False)
     embedding = Column(ARRAY(Float(50)), nullable=True)
     genres = Column(ARRAY(String(50)), nullable=True)
-    created_at = Column(DateTime, default=datetime.datetime.now())
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(
+        DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now
+    )
+    content_hash = Column(String(32), nullable=True)
     rating = relationship("Rating")
 
 
@@ -43,7 +63,166 @@ class Rating(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     rating = Column(Float, nullable=False)
     date = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.datetime.now())
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    updated_at = Column(
+        DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now
+    )
+    content_hash = Column(String(32), nullable=True)
+
+
+# The seeds of a recommendation are the best and latest ratings of the user, the
+# index returns them in that order and covers the movie, without reading the table
+Index(
+    "ix_ratings_user_rating",
+    Rating.user_id,
+    Rating.rating.desc(),
+    Rating.date.desc(),
+    postgresql_include=["movie_id"],
+)
+# Aggregating the ratings by movie, such as in the popularity rebuild, and the
+# foreign key checks of the movies
+Index("ix_ratings_movie", Rating.movie_id, postgresql_include=["rating"])
+
+
+class MoviePopularity(Base):
+    """Per-movie rating aggregates, kept up to date by a trigger on `ratings`"""
+
+    __tablename__ = "movie_popularity"
+    movie_id = Column(Integer, ForeignKey("movies.id"), primary_key=True)
+    rating_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Float, nullable=False, default=0)
+    rating_mean = Column(Float, nullable=False, default=0)
+
+
+Index(
+    "ix_movie_popularity_ranking",
+    MoviePopularity.rating_mean.desc(),
+    MoviePopularity.rating_count.desc(),
+)
+
+# Apply every insert, update and delete on ratings to the popularity aggregates.
+# The statements are idempotent, so they run on every create_all.
+MOVIE_POPULARITY_FUNCTION = (
+    DDL(
+        """
+CREATE OR REPLACE FUNCTION movie_popularity_refresh() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.movie_id IS NOT NULL THEN
+        UPDATE movie_popularity
+        SET rating_count = rating_count - 1,
+            rating_sum = rating_sum - OLD.rating,
+            rating_mean = CASE
+                WHEN rating_count > 1
+                THEN (rating_sum - OLD.rating) / (rating_count - 1)
+                ELSE 0
+            END
+        WHERE movie_id = OLD.movie_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.movie_id IS NOT NULL THEN
+        INSERT INTO movie_popularity AS p
+            (movie_id, rating_count, rating_sum, rating_mean)
+        VALUES (NEW.movie_id, 1, NEW.rating, NEW.rating)
+        ON CONFLICT (movie_id) DO UPDATE
+        SET rating_count = p.rating_count + 1,
+            rating_sum = p.rating_sum + EXCLUDED.rating_sum,
+            rating_mean = (p.rating_sum + EXCLUDED.rating_sum) / (p.rating_count + 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+    ),
+)
+# Replacing the trigger locks the whole ratings table, so it is only created when
+# missing. Otherwise every app start would wait for the open transactions on ratings.
+MOVIE_POPULARITY_TRIGGER = (
+    DDL("DROP TRIGGER IF EXISTS ratings_movie_popularity ON ratings"),
+    DDL(
+        "CREATE TRIGGER ratings_movie_popularity "
+        "AFTER INSERT OR UPDATE OR DELETE ON ratings "
+        "FOR EACH ROW EXECUTE FUNCTION movie_popularity_refresh()"
+    ),
+)
+
+
+def movie_popularity_trigger_missing(ddl, target, bind, **kwargs):
+    return not bind.execute(
+        text("SELECT 1 FROM pg_trigger WHERE tgname = 'ratings_movie_popularity'")
+    ).first()
+
+
+for statement in MOVIE_POPULARITY_FUNCTION:
+    event.listen(
+        Base.metadata, "after_create", statement.execute_if(dialect="postgresql")
+    )
+for statement in MOVIE_POPULARITY_TRIGGER:
+    event.listen(
+        Base.metadata,
+        "after_create",
+        statement.execute_if(
+            dialect="postgresql", callable_=movie_popularity_trigger_missing
+        ),
+    )
+
+
+class EmbeddingVersion(Base):
+    """Stamp written every time a new set of embeddings is loaded"""
+
+    __tablename__ = "embedding_versions"
+    id = Column(Integer, primary_key=True)
+    created_at = Column(DateTime, default=datetime.datetime.now)
+
+
+class LoadCheckpoint(Base):
+    """High-water mark of the incremental loads of a source, such as the ratings"""
+
+    __tablename__ = "load_checkpoints"
+    source = Column(String(50), primary_key=True)
+    high_water_mark = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.now)
+
+
+# Tables created before the incremental loader lack the content hash and the update
+# time of their rows. They are only added when missing, like the trigger, to not
+# lock the tables on every start.
+def column_missing(table, name):
+    def missing(ddl, target, bind, **kwargs):
+        return not bind.execute(
+            text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = :table AND column_name = :column"
+            ),
+            {"table": table, "column": name},
+        ).first()
+
+    return missing
+
+
+for model in (User, Movie, Rating):
+    event.listen(
+        Base.metadata,
+        "after_create",
+        DDL(
+            f"ALTER TABLE {model.__tablename__} ADD COLUMN content_hash VARCHAR(32)"
+        ).execute_if(
+            dialect="postgresql",
+            callable_=column_missing(model.__tablename__, "content_hash"),
+        ),
+    )
+    # The constant default stamps the existing rows without rewriting the table,
+    # and dropping it keeps their value. New rows get it from the models.
+    event.listen(
+        Base.metadata,
+        "after_create",
+        DDL(
+            f"ALTER TABLE {model.__tablename__} "
+            "ADD COLUMN updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(); "
+            f"ALTER TABLE {model.__tablename__} ALTER COLUMN updated_at DROP DEFAULT"
+        ).execute_if(
+            dialect="postgresql",
+            callable_=column_missing(model.__tablename__, "updated_at"),
+        ),
+    )
 
 
 class KNNVector(Field):
@@ -55,11 +234,14 @@ class KNNVector(Field):
 
 class VMovie(Document):
 
-    method = {"name": "hnsw", "space_type": "cosinesimil", "engine": "nmslib"}
+    # The lucene engine applies filters during the k-NN search, see `filter_query`
+    method = {"name": "hnsw", "space_type": "cosinesimil", "engine": "lucene"}
 
     movie_id = Keyword()
     url = Text()
     name = Text()
+    genres = Keyword(multi=True)
+    release_date = Date()
     created_at = Date()
 
     vector = KNNVector(KNN_VECTOR_DIMENSION, method)
@@ -74,10 +256,27 @@ class VMovie(Document):
         self.meta.id = self.movie_id
         return super(VMovie, self).save(**kwargs)
 
+    @staticmethod
+    def filter_query(genres=None, year_from=None, year_to=None):
+        """Return the filter of the movies with any of `genres` released between
+        `year_from` and `year_to`, both included. None leaves a constraint out.
+        """
+        clauses = []
+        if genres:
+            clauses.append({"terms": {"genres": list(genres)}})
+        years = {}
+        if year_from is not None:
+            years["gte"] = f"{year_from:04d}-01-01"
+        if year_to is not None:
+            years["lt"] = f"{year_to + 1:04d}-01-01"
+        if years:
+            clauses.append({"range": {"release_date": years}})
+        return {"bool": {"filter": clauses}}
+
 
 class VUser(Document):
 
-    method = {"name": "hnsw", "space_type": "cosinesimil", "engine": "nmslib"}
+    method = {"name": "hnsw", "space_type": "cosinesimil", "engine": "lucene"}
 
     user_id = Keyword()
     name = Text()
@@ -0,0 +1,77 @@
+"""Connection pools that keep statistics about how requests use them"""
+
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+def pool_options(config):
+    """Translate the `pool` section of the `sql` configuration to engine arguments"""
+    pool = config.get("pool") or {}
+    return {
+        "pool_size": pool.get("size", 5),
+        "max_overflow": pool.get("max_overflow", 10),
+        "pool_timeout": pool.get("timeout", 30),
+        "pool_pre_ping": pool.get("pre_ping", False),
+        "pool_recycle": pool.get("recycle", -1),
+    }
+
+
+class PoolStatsMixin:
+    """Count the checkouts that had to wait for a free connection.
+
+    A checkout waits when every connection is in use and the overflow is exhausted.
+    `waits` counts them, `wait_seconds` adds up how long they waited and `timeouts`
+    counts the ones that gave up after `pool_timeout` seconds.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        saturated = (
+            self._max_overflow > -1
+            and self.overflow() >= self._max_overflow
+            and self.checkedin() == 0
+        )
+        if not saturated:
+            return super()._do_get()
+
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_seconds += time.perf_counter() - start
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "max_overflow": self._max_overflow,
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "timeouts": self.timeouts,
+            }
+
+
+class InstrumentedQueuePool(PoolStatsMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(PoolStatsMixin, AsyncAdaptedQueuePool):
+    pass
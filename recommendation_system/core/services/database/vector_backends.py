@@ -0,0 +1,457 @@
+"""Vector search backends used by the VectorDBService"""
+
+import abc
+import asyncio
+import os
+import pickle
+import time
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+from core.services.database.hedging import AsyncHedger, Hedger
+from core.services.metrics import observe_took
+from core.services.tracing import capture
+from opensearchpy import AsyncOpenSearch, OpenSearch
+
+# Smallest request timeout sent to OpenSearch, once the deadline is almost spent
+MIN_TIMEOUT_SECONDS = 0.001
+
+
+def similarity_score(cosine):
+    """Map a cosine similarity to the score the lucene engine returns for `cosinesimil`.
+
+    Using the same scale keeps the scores comparable whatever backend is used.
+    """
+    return (1 + cosine) / 2
+
+
+class SearchFilter(NamedTuple):
+    """Restrict a k-NN search to the documents matching a filter.
+
+    `query` is the OpenSearch filter, applied by the engine while it walks the
+    graph, and `ids` the sorted ids of the same documents for the in-process
+    backends.
+    """
+
+    query: dict
+    ids: np.ndarray
+
+
+class SearchParams(NamedTuple):
+    """Tuning of a k-NN search, None keeps the default of the backend.
+
+    `num_candidates` is the number of nearest neighbors the approximate search
+    collects before returning the best ones, at least the number of results.
+    `ef_search` is the size of the HNSW candidate queue. `source` lists the fields
+    of every hit document to return, none by default. `filter` is an optional
+    SearchFilter only the matching documents are returned from. `deadline_ms` is
+    the time budget of a remote search, after which it fails with a timeout.
+    """
+
+    num_candidates: Optional[int] = None
+    ef_search: Optional[int] = None
+    source: Tuple[str, ...] = ()
+    filter: Optional[SearchFilter] = None
+    deadline_ms: Optional[int] = None
+
+    @classmethod
+    def from_config(cls, config, overrides=None):
+        """Build the params of an endpoint from its `search` configuration.
+
+        `num_candidates` and `ef_search` in `overrides`, the request arguments
+        parsed by the views, take precedence over the configuration.
+        """
+        values = dict(config or {})
+        for name in ("num_candidates", "ef_search"):
+            if overrides and overrides.get(name):
+                values[name] = int(overrides[name])
+        return cls(
+            num_candidates=values.get("num_candidates"),
+            ef_search=values.get("ef_search"),
+            source=tuple(values.get("source") or ()),
+            deadline_ms=values.get("deadline_ms"),
+        )
+
+
+class VectorSearchBackend(abc.ABC):
+    """Interface every vector search backend has to implement.
+
+    Hits are returned as `(document_id, score)` tuples sorted by descending score.
+    """
+
+    @property
+    def client(self):
+        raise NotImplementedError(
+            f"{type(self).__name__} does not expose an OpenSearch client"
+        )
+
+    def pool_stats(self):
+        """Return the usage of the connections to every node, None without a pool"""
+        return None
+
+    @abc.abstractmethod
+    def knn_msearch(self, index, vectors, size, excludes=None, params=None):
+        """Return the `size` nearest documents of `index` for every vector.
+
+        `excludes` optionally holds, for every vector, the document ids that must
+        not be returned. `params` are the SearchParams of the searches.
+        """
+
+
+class OpenSearchBackend(VectorSearchBackend):
+    """k-NN searches on OpenSearch.
+
+    With `hedging.enabled` in the configuration every node gets its own client and
+    the searches go through a Hedger, see `core.services.database.hedging`.
+    """
+
+    hedger_class = Hedger
+
+    def __init__(self, config):
+
+        hosts = config.get("hosts")
+        self._client = self.make_client(config, hosts)
+
+        hedging = dict(config.get("hedging") or {})
+        self.hedger = None
+        if hedging.pop("enabled", False) and len(hosts) > 1:
+            self.hedger = self.hedger_class(
+                {host: self.make_client(config, [host]) for host in hosts}, **hedging
+            )
+
+    def make_client(self, config, hosts):
+        pool = config.get("pool") or {}
+        return OpenSearch(
+            **self.client_options(config, hosts), pool_maxsize=pool.get("maxsize", 10)
+        )
+
+    @staticmethod
+    def client_options(config, hosts):
+        user = config.get("user")
+        password = os.environ[config.get("pass")]
+        port = config.get("port")
+        pool = config.get("pool") or {}
+
+        return dict(
+            hosts=[{"host": host, "port": port} for host in hosts],
+            http_auth=(user, password),
+            use_ssl=True,
+            verify_certs=False,
+            ssl_show_warn=False,
+            timeout=pool.get("timeout", 10),
+            # A retry would run past the deadline of the search, a failed search
+            # goes to the fallback and the dead node is skipped by the next ones
+            max_retries=pool.get("max_retries", 0),
+            retry_on_timeout=False,
+        )
+
+    @property
+    def client(self):
+        return self._client
+
+    def pool_stats(self):
+        if self.hedger is None:
+            return self.connection_stats(self.client)
+
+        # The latencies the hedger tracks for every node, next to its connections
+        stats = []
+        latencies = self.hedger.tracker.stats()
+        for host, client in self.hedger.clients.items():
+            for connection in self.connection_stats(client):
+                stats.append({**connection, **latencies[host]})
+        return stats
+
+    @staticmethod
+    def connection_stats(client):
+        # Nodes marked as dead are left out until they are resurrected
+        stats = []
+        for connection in client.transport.connection_pool.connections:
+            pool = connection.pool
+            stats.append(
+                {
+                    "host": connection.host,
+                    "maxsize": pool.pool.maxsize,
+                    # Connections beyond maxsize are opened and discarded, not queued
+                    "checked_out": max(pool.pool.maxsize - pool.pool.qsize(), 0),
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                }
+            )
+        return stats
+
+    @staticmethod
+    def knn_query(vector, size, exclude=None, params=None):
+        params = params or SearchParams()
+        exclude = exclude or []
+
+        # Excluded documents are filtered after the k-NN stage, so collect enough
+        # candidates to still return `size` hits once they are removed.
+        knn = {
+            "vector": vector,
+            "k": max(params.num_candidates or size, size) + len(exclude),
+        }
+        if params.ef_search:
+            knn["method_parameters"] = {"ef_search": params.ef_search}
+        if params.filter is not None:
+            # Efficient filtering: the engine returns the k nearest matching documents
+            knn["filter"] = params.filter.query
+
+        query = {"knn": {"vector": knn}}
+        if exclude:
+            query = {
+                "bool": {
+                    "must": [query],
+                    "must_not": [{"ids": {"values": [str(i) for i in exclude]}}],
+                }
+            }
+        # Only the ids and scores are read, so by default no document is returned
+        return {"size": size, "query": query, "_source": list(params.source) or False}
+
+    @staticmethod
+    def request_options(params, start):
+        """Per-request options of the client, the time left of the search deadline.
+
+        `start` is the `time.monotonic()` the search started at.
+        """
+        if params is None or not params.deadline_ms:
+            return {}
+        left = params.deadline_ms / 1000 - (time.monotonic() - start)
+        return {"request_timeout": max(left, MIN_TIMEOUT_SECONDS)}
+
+    @classmethod
+    def msearch_body(cls, index, vectors, size, excludes=None, params=None):
+        excludes = excludes or [None] * len(vectors)
+        body = []
+        for vector, exclude in zip(vectors, excludes):
+            body.append({"index": index})
+            body.append(cls.knn_query(vector, size, exclude, params))
+        return body
+
+    @staticmethod
+    def parse_msearch(index, response):
+        observe_took(index, response.get("took", 0))
+        # A failed sub-query yields no hits instead of failing the whole batch
+        return [
+            [
+                (int(hit["_id"]), hit["_score"])
+                for hit in r.get("hits", {}).get("hits", [])
+            ]
+            for r in response["responses"]
+        ]
+
+    def knn_msearch(self, index, vectors, size, excludes=None, params=None):
+        start = time.monotonic()
+        body = self.msearch_body(index, vectors, size, excludes, params)
+        capture("knn_query", body)
+        msearch = self.hedger.msearch if self.hedger else self.client.msearch
+        response = msearch(body=body, **self.request_options(params, start))
+        return self.parse_msearch(index, response)
+
+
+class AsyncOpenSearchBackend(OpenSearchBackend):
+    """OpenSearch backend for the asyncio endpoints, built on `AsyncOpenSearch`"""
+
+    hedger_class = AsyncHedger
+
+    def make_client(self, config, hosts):
+        pool = config.get("pool") or {}
+        return AsyncOpenSearch(
+            **self.client_options(config, hosts), maxsize=pool.get("maxsize", 10)
+        )
+
+    @staticmethod
+    def connection_stats(client):
+        # The transport creates its connections, and their aiohttp sessions, on
+        # the first request, so there are no stats before it
+        stats = []
+        for connection in client.transport.connection_pool.connections:
+            connector = connection.session.connector if connection.session else None
+            stats.append(
+                {
+                    "host": connection.host,
+                    "maxsize": connection._limit,
+                    "checked_out": len(connector._acquired) if connector else 0,
+                }
+            )
+        return stats
+
+    async def knn_msearch(self, index, vectors, size, excludes=None, params=None):
+        start = time.monotonic()
+        body = self.msearch_body(index, vectors, size, excludes, params)
+        capture("knn_query", body)
+        msearch = self.hedger.msearch if self.hedger else self.client.msearch
+        response = await msearch(body=body, **self.request_options(params, start))
+        return self.parse_msearch(index, response)
+
+    async def close(self):
+        await self.client.close()
+        if self.hedger is not None:
+            await self.hedger.close()
+
+
+class ThreadedBackend:
+    """Expose a synchronous backend to the asyncio endpoints.
+
+    Every search runs in a worker thread, so in-process searches such as the NumPy
+    one never block the event loop. The wrapped backend and its indexes are shared
+    with the synchronous endpoints.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @property
+    def client(self):
+        return self.backend.client
+
+    def pool_stats(self):
+        return self.backend.pool_stats()
+
+    async def knn_msearch(self, index, vectors, size, excludes=None, params=None):
+        return await asyncio.to_thread(
+            self.backend.knn_msearch, index, vectors, size, excludes, params
+        )
+
+    async def close(self):
+        pass
+
+
+class NumpyBackend(VectorSearchBackend):
+    """Exact in-process cosine k-NN over the embedding matrices saved by training"""
+
+    def __init__(self, config):
+        mmap = config.get("mmap", False)
+        self.indexes = {
+            name: self.load_index(**paths, mmap=mmap)
+            for name, paths in config.get("numpy", {}).items()
+        }
+
+    @staticmethod
+    def load_index(embeddings, mapping, mmap=False):
+        """Load an embedding matrix and its id mapping, with L2-normalized rows.
+
+        With `mmap` the normalized matrix is saved next to the original one and
+        memory-mapped, so every process serving it shares the same pages.
+        """
+        with open(mapping, "rb") as file:
+            id2idx = pickle.load(file)
+
+        ids = np.fromiter(id2idx.keys(), dtype=np.int64, count=len(id2idx))
+        rows = np.fromiter(id2idx.values(), dtype=np.int64, count=len(id2idx))
+        # Sort by id so excluded ids can be found with a binary search
+        order = np.argsort(ids)
+        ids, rows = ids[order], rows[order]
+
+        normalized_path = f"{os.path.splitext(embeddings)[0]}.normalized.npy"
+        if (
+            mmap
+            and os.path.exists(normalized_path)
+            and os.path.getmtime(normalized_path) >= os.path.getmtime(embeddings)
+            and os.path.getmtime(normalized_path) >= os.path.getmtime(mapping)
+        ):
+            return ids, np.load(normalized_path, mmap_mode="r")
+
+        # Normalize once so cosine similarity becomes a plain dot product
+        vectors = np.load(embeddings)[rows].astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        if mmap:
+            tmp_path = f"{normalized_path}.tmp.npy"
+            np.save(tmp_path, vectors)
+            os.replace(tmp_path, normalized_path)
+            return ids, np.load(normalized_path, mmap_mode="r")
+        return ids, vectors
+
+    def knn_msearch(self, index, vectors, size, excludes=None, params=None):
+        if index not in self.indexes:
+            raise ValueError(f"There is no numpy vector index named {index}")
+        ids, matrix = self.indexes[index]
+        return exact_search(ids, matrix, vectors, size, excludes, params)
+
+
+class CatalogBackend(VectorSearchBackend):
+    """Exact in-process search over the movie embeddings held by the MovieCatalog.
+
+    It needs no other data than the catalog the app already loads, so it is the
+    fallback of the VectorDBService when the primary backend is unavailable.
+    """
+
+    def __init__(self, catalog, index="movie"):
+        self.catalog = catalog
+        self.index = index
+        self._columns = None
+        self._matrix = None
+
+    def matrix(self):
+        """Return the ids and the normalized embeddings of the current snapshot"""
+        columns = self.catalog.columns
+        matrix = self._matrix
+        if columns is not self._columns or matrix is None:
+            embeddings = columns.embeddings
+            rows = (
+                ~np.isnan(embeddings).any(axis=1)
+                if embeddings.shape[1]
+                else np.zeros(len(columns.ids), dtype=bool)
+            )
+            vectors = embeddings[rows]
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            matrix = (
+                columns.ids[rows].astype(np.int64),
+                vectors / np.where(norms == 0, 1, norms),
+            )
+            self._columns, self._matrix = columns, matrix
+        return matrix
+
+    def knn_msearch(self, index, vectors, size, excludes=None, params=None):
+        if index != self.index:
+            raise ValueError(f"The catalog has no vector index named {index}")
+        ids, matrix = self.matrix()
+        return exact_search(ids, matrix, vectors, size, excludes, params)
+
+
+def exact_search(ids, matrix, vectors, size, excludes=None, params=None):
+    """Exact cosine k-NN of `vectors` over the L2-normalized rows of `matrix`.
+
+    `ids` are the sorted document ids of the rows. The search is exact, so only
+    the filter of the search params applies.
+    """
+    size = min(size, len(ids))
+    if not len(vectors) or size <= 0:
+        return [[] for _ in vectors]
+
+    queries = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    queries /= np.where(norms == 0, 1, norms)
+
+    similarities = queries @ matrix.T
+    if params is not None and params.filter is not None:
+        similarities[:, ~np.isin(ids, params.filter.ids)] = -np.inf
+    for i, exclude in enumerate(excludes or []):
+        if exclude:
+            exclude = np.asarray(exclude, dtype=np.int64)
+            rows = np.minimum(np.searchsorted(ids, exclude), len(ids) - 1)
+            similarities[i, rows[ids[rows] == exclude]] = -np.inf
+
+    top = np.argpartition(-similarities, size - 1, axis=1)[:, :size]
+    top_similarities = np.take_along_axis(similarities, top, axis=1)
+    order = np.argsort(-top_similarities, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    scores = similarity_score(np.take_along_axis(top_similarities, order, axis=1))
+
+    # Excluded and filtered out documents end up with a score of -inf and
+    # are dropped
+    return [
+        [
+            (doc_id, score)
+            for doc_id, score in zip(ids[row].tolist(), row_scores.tolist())
+            if score > -np.inf
+        ]
+        for row, row_scores in zip(top, scores)
+    ]
+
+
+BACKENDS = {"opensearch": OpenSearchBackend, "numpy": NumpyBackend}
+
+# Backends with a native asyncio client, the others run through a ThreadedBackend
+ASYNC_BACKENDS = {"opensearch": AsyncOpenSearchBackend}
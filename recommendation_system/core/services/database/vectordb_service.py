@@ -1,21 +1,201 @@
-import os
+import asyncio
+import logging
 
-from opensearchpy import OpenSearch
+from core.services.database.circuit_breaker import CircuitBreaker
+from core.services.database.vector_backends import (
+    ASYNC_BACKENDS,
+    BACKENDS,
+    ThreadedBackend,
+)
+from core.services.metrics import observe_fallback, stage
+from core.services.tracing import capture
+from opensearchpy.exceptions import ConnectionError as OpenSearchConnectionError
+from opensearchpy.exceptions import ConnectionTimeout, RequestError, TransportError
+
+logger = logging.getLogger(__name__)
+
+
+class VectorSearchUnavailable(Exception):
+    """Neither the vector backend nor its fallback could answer a search"""
+
+
+class InvalidVectorSearch(ValueError):
+    """The vector backend rejected the search, the request has to be fixed"""
+
+
+def is_backend_failure(error):
+    """Return whether `error` means the backend is down or overloaded.
+
+    Connection errors, timeouts and 5xx responses count towards opening the
+    circuit breaker. Rejected requests and local errors do not.
+    """
+    if isinstance(error, (OpenSearchConnectionError, asyncio.TimeoutError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return (
+        isinstance(error, TransportError) and isinstance(status, int) and status >= 500
+    )
+
+
+def handle_error(breaker, error):
+    """Raise the errors of a search that must not trip the breaker nor fall back"""
+    if isinstance(error, RequestError):
+        breaker.release()
+        raise InvalidVectorSearch(f"Invalid vector search: {error.error}") from error
+    if not is_backend_failure(error):
+        breaker.release()
+        raise error
+
+
+def failure_reason(error):
+    if isinstance(error, (ConnectionTimeout, asyncio.TimeoutError)):
+        return "timeout"
+    return "error"
 
 
 class VectorDBService:
+    """Run the vector searches of the app on the configured backend.
+
+    A circuit breaker, set up by the `breaker` configuration, guards the backend.
+    Searches that fail or run past the `deadline_ms` of their SearchParams, and
+    every search while the breaker is open, are answered by the `fallback`
+    backend. VectorSearchUnavailable is raised when there is none or it fails.
+    Searches the backend rejects raise InvalidVectorSearch and other errors are
+    raised as they are, neither of them trips the breaker.
+    """
+
+    def __init__(self, config, fallback=None):
 
-    def __init__(self, config):
+        backend = config.get("backend", "opensearch")
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown vector backend {backend}. Available: {', '.join(BACKENDS)}"
+            )
+        self.backend = BACKENDS[backend](config)
+        self.fallback = fallback
+        self.breaker = CircuitBreaker(**(config.get("breaker") or {}))
 
-        user = config.get("user")
-        password = os.environ[config.get("pass")]
-        hosts = config.get("hosts")
-        port = config.get("port")
+    @property
+    def client(self):
+        """Raw OpenSearch client, only available with the opensearch backend"""
+        return self.backend.client
 
-        self.client = OpenSearch(
-            hosts=[{"host": host, "port": port} for host in hosts],
-            http_auth=(user, password),
-            use_ssl=True,
-            verify_certs=False,
-            ssl_show_warn=False,
+    def pool_stats(self):
+        """Return the usage of the connections to every node, None without a pool"""
+        return self.backend.pool_stats()
+
+    def knn_search(self, index, vector, size, exclude=None, params=None):
+        """Return the `size` nearest `(document_id, score)` tuples of `vector`"""
+        excludes = [exclude] if exclude else None
+        return self.knn_msearch(index, [vector], size, excludes, params)[0]
+
+    def knn_msearch(self, index, vectors, size, excludes=None, params=None):
+        """Run one k-NN query per vector in a single batch.
+
+        `excludes` optionally lists, for every vector, document ids to leave out.
+        `params` are the SearchParams tuning the searches.
+        Returns a list with the hits of every query, in the same order as `vectors`.
+        """
+        if not vectors:
+            return []
+        with stage("vector_search"):
+            if not self.breaker.allow():
+                return self.search_fallback(
+                    "open", index, vectors, size, excludes, params
+                )
+            try:
+                # The backend sends the time left of the deadline as the request
+                # timeout, without retries, so the search fits in the deadline
+                hits = self.backend.knn_msearch(index, vectors, size, excludes, params)
+            except Exception as error:
+                handle_error(self.breaker, error)
+                self.breaker.record_failure()
+                logger.warning(f"Vector search failed: {error!r}")
+                return self.search_fallback(
+                    failure_reason(error), index, vectors, size, excludes, params
+                )
+            self.breaker.record_success()
+            return hits
+
+    def search_fallback(self, reason, index, vectors, size, excludes, params):
+        observe_fallback(reason)
+        capture("vector_fallback", reason)
+        if self.fallback is None:
+            raise VectorSearchUnavailable(f"Vector search {reason}, without fallback")
+        try:
+            with stage("vector_fallback"):
+                return self.fallback.knn_msearch(index, vectors, size, excludes, params)
+        except Exception as error:
+            raise VectorSearchUnavailable(f"Vector fallback failed: {error}") from error
+
+
+class AsyncVectorDBService:
+    """Asyncio counterpart of the VectorDBService used by the async endpoints.
+
+    Backends without an asyncio client reuse the ones of `vector_db`, so their
+    indexes are not loaded twice, and so does the fallback.
+    """
+
+    def __init__(self, config, vector_db):
+
+        backend = config.get("backend", "opensearch")
+        if backend in ASYNC_BACKENDS:
+            self.backend = ASYNC_BACKENDS[backend](config)
+        else:
+            self.backend = ThreadedBackend(vector_db.backend)
+        self.fallback = (
+            ThreadedBackend(vector_db.fallback) if vector_db.fallback else None
         )
+        self.breaker = CircuitBreaker(**(config.get("breaker") or {}))
+
+    def pool_stats(self):
+        """Return the usage of the connections to every node, None without a pool"""
+        return self.backend.pool_stats()
+
+    async def knn_search(self, index, vector, size, exclude=None, params=None):
+        """Return the `size` nearest `(document_id, score)` tuples of `vector`"""
+        excludes = [exclude] if exclude else None
+        return (await self.knn_msearch(index, [vector], size, excludes, params))[0]
+
+    async def knn_msearch(self, index, vectors, size, excludes=None, params=None):
+        """Run one k-NN query per vector in a single batch, see VectorDBService"""
+        if not vectors:
+            return []
+        deadline = params.deadline_ms / 1000 if params and params.deadline_ms else None
+        with stage("vector_search"):
+            if not self.breaker.allow():
+                return await self.search_fallback(
+                    "open", index, vectors, size, excludes, params
+                )
+            try:
+                # The client timeout only bounds the network calls, the whole
+                # search, retries included, has to fit in the deadline
+                hits = await asyncio.wait_for(
+                    self.backend.knn_msearch(index, vectors, size, excludes, params),
+                    deadline,
+                )
+            except Exception as error:
+                handle_error(self.breaker, error)
+                self.breaker.record_failure()
+                logger.warning(f"Vector search failed: {error!r}")
+                return await self.search_fallback(
+                    failure_reason(error), index, vectors, size, excludes, params
+                )
+            self.breaker.record_success()
+            return hits
+
+    async def search_fallback(self, reason, index, vectors, size, excludes, params):
+        observe_fallback(reason)
+        capture("vector_fallback", reason)
+        if self.fallback is None:
+            raise VectorSearchUnavailable(f"Vector search {reason}, without fallback")
+        try:
+            with stage("vector_fallback"):
+                return await self.fallback.knn_msearch(
+                    index, vectors, size, excludes, params
+                )
+        except Exception as error:
+            raise VectorSearchUnavailable(f"Vector fallback failed: {error}") from error
+
+    async def close(self):
+        await self.backend.close()
@@ -0,0 +1,50 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingVersionWatcher:
+    """Poll the embedding version stamp and notify subscribers when it changes.
+
+    `data/load_embeddings.py` runs in its own process, so every API process
+    notices a new embedding load by checking the latest version stamp at most
+    once every `interval` seconds.
+    """
+
+    def __init__(self, sqldb, interval=10):
+        self.sqldb = sqldb
+        self.interval = interval
+        self.version = None
+        self._callbacks = []
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Register a callable invoked with the new version after every change"""
+        self._callbacks.append(callback)
+
+    def check(self):
+        now = time.monotonic()
+        if self._last_check is not None and now - self._last_check < self.interval:
+            return
+
+        # Only one thread polls the database, the others keep serving requests
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            first_check = self._last_check is None
+            self._last_check = now
+            version = self.sqldb.get_embedding_version()
+            if first_check or version == self.version:
+                self.version = version
+                return
+            previous, self.version = self.version, version
+            logger.info(f"Embedding version changed from {previous} to {version}")
+            for callback in self._callbacks:
+                callback(version)
+        except Exception:
+            logger.exception("Could not check the embedding version")
+        finally:
+            self._lock.release()
@@ -0,0 +1,27 @@
+"""Init file for the metrics service"""
+
+from core.services.metrics.metrics import (
+    endpoint_label,
+    observe_cache,
+    observe_coalesced,
+    observe_fallback,
+    observe_hedge,
+    observe_request,
+    observe_took,
+    render_metrics,
+    set_endpoint,
+    stage,
+)
+
+__all__ = [
+    "endpoint_label",
+    "observe_cache",
+    "observe_coalesced",
+    "observe_fallback",
+    "observe_hedge",
+    "observe_request",
+    "observe_took",
+    "render_metrics",
+    "set_endpoint",
+    "stage",
+]
@@ -0,0 +1,126 @@
+"""Prometheus metrics of the recommendation endpoints.
+
+Every stage is labeled with the endpoint of the request it runs for, which the
+app sets at the start of the request. Under gunicorn the workers write their
+metrics to `PROMETHEUS_MULTIPROC_DIR` and any of them can render all of them.
+"""
+
+import contextlib
+import contextvars
+import os
+import time
+
+from core.services.tracing import record_span
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Latencies of a cached response are well below a millisecond, a live search can take seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+REQUESTS = Counter(
+    "recsys_requests", "Requests served", ["endpoint", "method", "status"]
+)
+REQUEST_SECONDS = Histogram(
+    "recsys_request_seconds", "Request latency", ["endpoint"], buckets=BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "recsys_stage_seconds",
+    "Latency of every stage of a request",
+    ["endpoint", "stage"],
+    buckets=BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "recsys_cache_requests", "Response cache lookups", ["endpoint", "result"]
+)
+COALESCED_REQUESTS = Counter(
+    "recsys_coalesced_requests",
+    "Requests answered by the computation of an identical request in flight",
+    ["endpoint"],
+)
+OPENSEARCH_TOOK = Histogram(
+    "recsys_opensearch_took_seconds",
+    "Time OpenSearch reports it spent on every search request",
+    ["index"],
+    buckets=BUCKETS,
+)
+VECTOR_FALLBACKS = Counter(
+    "recsys_vector_fallbacks",
+    "Vector searches answered by the fallback, by the reason the primary was skipped",
+    ["endpoint", "reason"],
+)
+HEDGED_REQUESTS = Counter(
+    "recsys_hedged_requests",
+    "Duplicate vector search requests sent to a second node, and the ones it won",
+    ["endpoint", "result"],
+)
+
+_endpoint = contextvars.ContextVar("metrics_endpoint", default="none")
+
+
+def endpoint_label(rule):
+    """Label of the endpoint of a url rule, "unmatched" for requests that matched none"""
+    # Blueprints mounted on "/" give rules such as "//user/<user_id>"
+    return "/" + rule.lstrip("/") if rule else "unmatched"
+
+
+def set_endpoint(endpoint):
+    """Label the metrics recorded from now on, in this context, with `endpoint`"""
+    _endpoint.set(endpoint)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time the block as the `name` stage of the current endpoint.
+
+    The stage is also added as a span to the trace of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        STAGE_SECONDS.labels(_endpoint.get(), name).observe(end - start)
+        record_span(name, start, end)
+
+
+def observe_request(endpoint, method, status, seconds):
+    REQUESTS.labels(endpoint, method, status).inc()
+    REQUEST_SECONDS.labels(endpoint).observe(seconds)
+
+
+def observe_cache(result):
+    """Count a response cache lookup, with a "hit", "stale" or "miss" `result`"""
+    CACHE_REQUESTS.labels(_endpoint.get(), result).inc()
+
+
+def observe_coalesced():
+    COALESCED_REQUESTS.labels(_endpoint.get()).inc()
+
+
+def observe_took(index, took_ms):
+    OPENSEARCH_TOOK.labels(index).observe(took_ms / 1000)
+
+
+def observe_fallback(reason):
+    VECTOR_FALLBACKS.labels(_endpoint.get(), reason).inc()
+
+
+def observe_hedge(result):
+    HEDGED_REQUESTS.labels(_endpoint.get(), result).inc()
+
+
+def render_metrics():
+    """Return the metrics in the Prometheus text format and its content type"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,9 @@
+"""Init file for the precomputed neighbors service"""
+
+from core.services.neighbors.neighbor_table import (
+    NeighborTable,
+    build_neighbor_table,
+    save_neighbor_table,
+)
+
+__all__ = ["NeighborTable", "build_neighbor_table", "save_neighbor_table"]
@@ -0,0 +1,146 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from core.services.database.vector_backends import similarity_score
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+ARRAYS = ("ids", "neighbors", "scores")
+
+
+def build_neighbor_table(ids, vectors, k, block_size=1024, workers=None):
+    """Compute the `k` most similar items of every item.
+
+    `vectors` must be L2-normalized. Similarities are computed one block of rows at
+    a time, so memory stays at `block_size x len(ids)` floats per worker. Blocks run
+    on a thread pool since the matrix products release the GIL.
+
+    Returns the neighbor ids and their scores, both with shape `(len(ids), k)`.
+    """
+    n = len(ids)
+    k = min(k, n - 1)
+    neighbors = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+
+    def compute_block(start):
+        end = min(start + block_size, n)
+        similarities = vectors[start:end] @ vectors.T
+        # An item is never its own neighbor
+        similarities[np.arange(end - start), np.arange(start, end)] = -np.inf
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1)
+        neighbors[start:end] = ids[np.take_along_axis(top, order, axis=1)]
+        scores[start:end] = similarity_score(
+            np.take_along_axis(top_similarities, order, axis=1)
+        )
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(compute_block, range(0, n, block_size)))
+
+    return neighbors, scores
+
+
+def save_neighbor_table(path, ids, neighbors, scores, embedding_version):
+    """Persist the table as .npy files that the API memory-maps.
+
+    Every file is written aside and moved into place, and the manifest is written
+    last, so readers never load a half written table.
+    """
+    os.makedirs(path, exist_ok=True)
+    order = np.argsort(ids)
+    arrays = {
+        "ids": ids[order].astype(np.int32),
+        "neighbors": neighbors[order],
+        "scores": scores[order],
+    }
+    for name, array in arrays.items():
+        tmp_path = os.path.join(path, f"{name}.tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+
+    manifest = {
+        "embedding_version": embedding_version,
+        "k": int(neighbors.shape[1]),
+        "items": int(len(ids)),
+    }
+    tmp_path = os.path.join(path, f"{MANIFEST}.tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+
+class NeighborTable:
+    """Memory-mapped lookup of the neighbors computed by `data/build_neighbors.py`.
+
+    The table is only served while it was built from the embedding version the
+    watcher currently sees, otherwise callers fall back to a live search.
+    """
+
+    def __init__(self, path, watcher, reload_interval=30):
+        self.path = path
+        self.watcher = watcher
+        self.reload_interval = reload_interval
+        self.table = None
+        self._mtime = None
+        self._last_check = None
+        self._lock = threading.Lock()
+        self.maybe_reload()
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if (
+            self._last_check is not None
+            and now - self._last_check < self.reload_interval
+        ):
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_check = now
+            manifest_path = os.path.join(self.path, MANIFEST)
+            if not os.path.exists(manifest_path):
+                return
+            mtime = os.path.getmtime(manifest_path)
+            if mtime == self._mtime:
+                return
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            arrays = {
+                name: np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+                for name in ARRAYS
+            }
+            self.table = (manifest, arrays)
+            self._mtime = mtime
+            logger.info(f"Loaded neighbor table {manifest}")
+        except Exception:
+            logger.exception("Could not load the neighbor table")
+        finally:
+            self._lock.release()
+
+    def lookup(self, item_id, size):
+        """Return the `size` nearest `(id, score)` tuples, None if not available"""
+        if self.table is None:
+            return None
+        manifest, arrays = self.table
+        if manifest["embedding_version"] != self.watcher.version:
+            return None
+        if size > manifest["k"]:
+            return None
+
+        ids = arrays["ids"]
+        row = int(np.searchsorted(ids, item_id))
+        if row >= len(ids) or ids[row] != item_id:
+            return None
+        return list(
+            zip(
+                arrays["neighbors"][row, :size].tolist(),
+                arrays["scores"][row, :size].tolist(),
+            )
+        )
@@ -0,0 +1,5 @@
+"""Init file for the seen items service"""
+
+from core.services.seen.seen_items import SeenItemsIndex
+
+__all__ = ["SeenItemsIndex"]
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from core.services.database import Rating
+from sqlalchemy import select, tuple_
+
+logger = logging.getLogger(__name__)
+
+
+class SeenItemsIndex:
+    """Compact in-memory index of the movies every user has rated.
+
+    Ratings are kept in CSR form: sorted user ids, the offset of every user in the
+    items array and the sorted movie ids of each user, all as int32/int64 arrays.
+    Ratings inserted or updated later are polled with an `(updated_at, id)` cursor,
+    since loaders insert them with the ids of the files, and kept in a small per-user
+    delta that is merged back into the arrays once it grows past `compact_threshold`.
+    """
+
+    def __init__(self, sqldb, refresh_interval=30, compact_threshold=10000):
+        self.sqldb = sqldb
+        self.refresh_interval = refresh_interval
+        self.compact_threshold = compact_threshold
+        self.high_water = None
+        self._delta = {}
+        self._delta_size = 0
+        self._last_refresh = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        users, movies, high_water = self._fetch()
+        with self._lock:
+            self.csr = self._build(users, movies)
+            self.high_water = high_water
+            self._delta = {}
+            self._delta_size = 0
+            self._last_refresh = time.monotonic()
+        logger.info(f"Seen items index loaded with {len(self.csr[0])} users")
+
+    def maybe_refresh(self):
+        """Add the ratings inserted or updated since the last refresh, at most every
+        interval
+        """
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_refresh = time.monotonic()
+            users, movies, high_water = self._fetch(self.high_water)
+            if len(users):
+                self._add(users, movies)
+                self.high_water = high_water
+        except Exception:
+            logger.exception("Could not refresh the seen items index")
+        finally:
+            self._lock.release()
+
+    def add(self, user_id, movie_ids):
+        """Register ratings inserted by this process without waiting for a refresh"""
+        movie_ids = np.asarray(movie_ids, dtype=np.int32)
+        with self._lock:
+            self._add(np.full(len(movie_ids), user_id, dtype=np.int32), movie_ids)
+
+    def seen(self, user_id):
+        """Return the sorted ids of the movies the user has rated"""
+        user_ids, offsets, items = self.csr
+        row = np.searchsorted(user_ids, user_id)
+        if row < len(user_ids) and user_ids[row] == user_id:
+            seen = items[offsets[row] : offsets[row + 1]]
+        else:
+            seen = items[:0]
+        delta = self._delta.get(user_id)
+        return seen if delta is None else np.union1d(seen, delta)
+
+    def unseen(self, user_id, movie_ids):
+        """Keep the movies the user has not rated, preserving their order"""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        seen = self.seen(user_id)
+        if not len(seen) or not len(movie_ids):
+            return movie_ids.tolist()
+        positions = np.minimum(np.searchsorted(seen, movie_ids), len(seen) - 1)
+        return movie_ids[seen[positions] != movie_ids].tolist()
+
+    def _fetch(self, after=None):
+        """Return the users and movies of the ratings after the `(updated_at, id)`
+        cursor `after`, all of them without one, and the cursor of the last rating
+        """
+        stmt = select(
+            Rating.user_id, Rating.movie_id, Rating.updated_at, Rating.id
+        ).where(Rating.user_id.is_not(None), Rating.movie_id.is_not(None))
+        if after is not None:
+            stmt = stmt.where(tuple_(Rating.updated_at, Rating.id) > tuple_(*after))
+
+        users, movies, high_water = [], [], after
+        with self.sqldb.engine.connect() as conn:
+            result = conn.execution_options(yield_per=100000).execute(stmt)
+            for partition in result.partitions():
+                # Plain sequences: numpy is very slow converting Row objects directly
+                user_ids, movie_ids, stamps, ids = zip(*partition)
+                users.append(np.array(user_ids, dtype=np.int32))
+                movies.append(np.array(movie_ids, dtype=np.int32))
+                high_water = max(
+                    (
+                        cursor
+                        for cursor in (*zip(stamps, ids), high_water)
+                        if cursor is not None and cursor[0] is not None
+                    ),
+                    default=None,
+                )
+
+        if not users:
+            return np.empty(0, np.int32), np.empty(0, np.int32), high_water
+        return np.concatenate(users), np.concatenate(movies), high_water
+
+    @staticmethod
+    def _build(users, movies):
+        # Sort and deduplicate (user, movie) pairs in one go with a packed key
+        keys = np.unique(users.astype(np.int64) << 32 | movies.astype(np.int64))
+        users = (keys >> 32).astype(np.int32)
+        items = (keys & 0xFFFFFFFF).astype(np.int32)
+        user_ids, starts = np.unique(users, return_index=True)
+        offsets = np.append(starts, len(items)).astype(np.int64)
+        return user_ids, offsets, items
+
+    def _add(self, users, movies):
+        """Add ratings to the delta. Must be called holding the lock"""
+        for user_id in np.unique(users):
+            new = movies[users == user_id]
+            current = self._delta.get(int(user_id))
+            self._delta[int(user_id)] = (
+                np.unique(new) if current is None else np.union1d(current, new)
+            )
+        self._delta_size += len(users)
+
+        if self._delta_size >= self.compact_threshold:
+            user_ids, offsets, items = self.csr
+            delta_users = np.concatenate(
+                [np.full(len(m), u, dtype=np.int32) for u, m in self._delta.items()]
+            )
+            delta_movies = np.concatenate(list(self._delta.values()))
+            self.csr = self._build(
+                np.concatenate([np.repeat(user_ids, np.diff(offsets)), delta_users]),
+                np.concatenate([items, delta_movies]),
+            )
+            self._delta = {}
+            self._delta_size = 0
@@ -0,0 +1,21 @@
+"""Init file for the tracing service"""
+
+from core.services.tracing.tracer import (
+    JsonFormatter,
+    capture,
+    configure_trace_logger,
+    current_trace,
+    finish_trace,
+    record_span,
+    start_trace,
+)
+
+__all__ = [
+    "JsonFormatter",
+    "capture",
+    "configure_trace_logger",
+    "current_trace",
+    "finish_trace",
+    "record_span",
+    "start_trace",
+]
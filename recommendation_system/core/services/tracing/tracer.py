@@ -0,0 +1,127 @@
+"""Request tracing with sampled payload capture.
+
+Every request gets a trace with an id and the spans of its stages. Payloads are
+captured by reference and only serialized when the trace is logged, which only
+happens for sampled requests and for the ones slower than a threshold.
+"""
+
+import contextvars
+import json
+import logging
+import random
+import sys
+import time
+import uuid
+
+logger = logging.getLogger("recsys.trace")
+
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+
+    def __init__(self, name, trace_id=None, sampled=False):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.sampled = sampled
+        self.start = time.perf_counter()
+        self.spans = []
+        self.payloads = {}
+
+    def as_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "sampled": self.sampled,
+            "spans": [
+                {
+                    "name": name,
+                    "start_ms": round((start - self.start) * 1000, 3),
+                    "duration_ms": round((end - start) * 1000, 3),
+                }
+                for name, start, end in self.spans
+            ],
+            "payloads": self.payloads,
+        }
+
+
+class JsonFormatter(logging.Formatter):
+    """Format every record as a JSON object, built only when a handler emits it"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        trace = getattr(record, "trace", None)
+        if trace is not None:
+            entry.update(trace.as_dict())
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_trace_logger():
+    """Send the traces to stderr as JSON lines, only once per process"""
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def start_trace(name, trace_id=None, sample_rate=0.0):
+    """Start the trace of the current request, sampled with `sample_rate` odds"""
+    trace = Trace(name, trace_id, sampled=random.random() < sample_rate)
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+def record_span(name, start, end):
+    """Add a span, with `time.perf_counter` bounds, to the current trace if any"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.spans.append((name, start, end))
+
+
+def capture(key, value):
+    """Keep a payload of the current request, serialized only if its trace is logged"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.payloads[key] = value
+
+
+def finish_trace(slow_threshold_ms, **fields):
+    """End the current trace and log it if it was sampled or slow"""
+    trace = _trace.get()
+    if trace is None:
+        return None
+    _trace.set(None)
+
+    duration_ms = (time.perf_counter() - trace.start) * 1000
+    slow = duration_ms >= slow_threshold_ms
+    if trace.sampled or slow:
+        logger.info(
+            "%s request %s took %.1f ms",
+            "Slow" if slow else "Sampled",
+            trace.trace_id,
+            duration_ms,
+            extra={
+                "trace": trace,
+                "fields": {
+                    **fields,
+                    "duration_ms": round(duration_ms, 3),
+                    "slow": slow,
+                },
+            },
+        )
+    return trace
@@ -0,0 +1,49 @@
+"""File to precompute the nearest neighbors of every movie"""
+
+import logging
+import time
+
+from core.services.configuration import ConfigurationManager
+from core.services.database import DatabaseService
+from core.services.database.vector_backends import NumpyBackend
+from core.services.neighbors import build_neighbor_table, save_neighbor_table
+
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler()],  # Ensures logs are sent to stdout
+)
+
+logger = logging.getLogger(__name__)
+
+
+def build_neighbors(embedding_version=None, output_path="neighbors"):
+    config = ConfigurationManager.init_config()
+    neighbors_config = config["neighbors"]
+
+    if embedding_version is None:
+        sql_client = DatabaseService(config["sql"])
+        embedding_version = sql_client.get_embedding_version()
+
+    logger.info("Loading movie embeddings")
+    ids, vectors = NumpyBackend.load_index(
+        embeddings="movie_embeddings_matrix.npy", mapping="movie2Idx.pkl"
+    )
+
+    logger.info(f"Computing the {neighbors_config['k']} neighbors of {len(ids)} movies")
+    start = time.perf_counter()
+    neighbors, scores = build_neighbor_table(
+        ids,
+        vectors,
+        k=neighbors_config["k"],
+        block_size=neighbors_config["block_size"],
+    )
+    logger.info(f"Neighbors computed in {time.perf_counter() - start:.2f}s")
+
+    save_neighbor_table(output_path, ids, neighbors, scores, embedding_version)
+    logger.info(f"Neighbor table saved for embedding version {embedding_version}")
+
+
+if __name__ == "__main__":
+    build_neighbors()
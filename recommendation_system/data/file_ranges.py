@@ -0,0 +1,52 @@
+"""Split text files in byte ranges of whole lines, to read them in parallel"""
+
+import io
+import os
+
+
+class FileRange(io.RawIOBase):
+    """Binary file that only reads the bytes between `start` and `end`"""
+
+    def __init__(self, path, start, end):
+        super().__init__()
+        self.file = open(path, "rb")
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file.read(min(len(buffer), self.remaining))
+        buffer[: len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def open_range(path, start, end):
+    """Open the bytes between `start` and `end` of `path` as a buffered file"""
+    return io.BufferedReader(FileRange(path, start, end))
+
+
+def line_ranges(path, partitions, skip_header=True):
+    """Split `path` in up to `partitions` byte ranges of about the same size.
+
+    Every range starts at the beginning of a line and ends after a newline, or at
+    the end of the file, so each one can be parsed on its own.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        if skip_header:
+            file.readline()
+        offsets = [file.tell()]
+        for partition in range(1, partitions):
+            file.seek(max(size * partition // partitions, offsets[-1]))
+            # Move to the start of the next line
+            file.readline()
+            offsets.append(min(file.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
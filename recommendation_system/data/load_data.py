@@ -1,10 +1,28 @@
 """File to load data into database"""
 
+import argparse
+import datetime
+import functools
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
 from core.services.configuration import ConfigurationManager
-from core.services.database import DatabaseService, Movie, Rating, User
+from core.services.database import DatabaseService, LoadCheckpoint, Movie, Rating, User
+from core.services.database.bulk import (
+    bulk_load,
+    content_hash,
+    deferred_indexes,
+    disabled_triggers,
+    reset_sequence,
+    upsert_dataframe,
+)
+from file_ranges import line_ranges, open_range
+from sqlalchemy import create_engine, func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.pool import NullPool
 
 # Configure the logger
 logging.basicConfig(
@@ -16,15 +34,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def load_data():
-    config = ConfigurationManager.init_config()
-    client = DatabaseService(config["sql"], drop_tables=True)
-
-    logger.info("Loading user data")
+def read_users():
     users = pd.read_csv("usuarios.csv")
     user_info = pd.read_csv("personas.csv")
 
-    users = users.merge(user_info, on="id").rename(
+    return users.merge(user_info, on="id").rename(
         columns={
             "Occupation": "occupation",
             "Active Since": "active_since",
@@ -35,14 +49,8 @@ def load_data():
         }
     )
 
-    users_to_add = []
-    for _, row in users.iterrows():
-        users_to_add.append(User(**row))
-    client.db_session.add_all(users_to_add)
-    client.db_session.commit()
-    logger.info(f"Loaded {client.db_session.query(User).count()} users")
 
-    logger.info("Loading Movies data")
+def read_movies():
     movies = pd.read_csv("peliculas.csv")
     genres_cols = movies.select_dtypes(include=["int64"]).columns.to_list()
     genres_cols.remove("id")  # Remove the id column to keep only genres
@@ -55,35 +63,297 @@ def load_data():
     )
     movies["release_date"] = pd.to_datetime(movies["release_date"])
     movies.dropna(subset=["release_date"], inplace=True)
+    # The url is required, the ORM used to store the missing ones as "NaN"
+    movies["url"] = movies["url"].fillna("")
+    return movies
+
+
+# Ratings are read and written this many rows at a time, so the memory used stays
+# the same whatever the size of the file
+RATINGS_CHUNK_ROWS = 100_000
+
+RATINGS_FILE = "scores.csv"
+RATINGS_COLUMNS = ["id", "user_id", "movie_id", "rating", "date"]
+RATINGS_DTYPES = {
+    "id": "int32",
+    "user_id": "int32",
+    "movie_id": "int32",
+    "rating": "float32",
+}
+
+
+def read_ratings(user_ids, movie_ids, chunk_rows=RATINGS_CHUNK_ROWS, byte_range=None):
+    """Yield the ratings of known users and movies with their content hash,
+    `chunk_rows` lines at a time.
+
+    :param byte_range: start and end offsets of the lines to read, given by
+        `line_ranges`. The whole file is read when None.
+    """
+    if byte_range is None:
+        source, header = RATINGS_FILE, 0
+    else:
+        source, header = open_range(RATINGS_FILE, *byte_range), None
+    chunks = pd.read_csv(
+        source,
+        header=header,
+        names=RATINGS_COLUMNS,
+        dtype=RATINGS_DTYPES,
+        parse_dates=["date"],
+        chunksize=chunk_rows,
+    )
+    with chunks:
+        for chunk in chunks:
+            # Remove ratings with invalid movie or user ids
+            valid = np.isin(chunk["movie_id"], movie_ids) & np.isin(
+                chunk["user_id"], user_ids
+            )
+            yield with_content_hash(chunk[valid])
+
+
+def with_content_hash(frame):
+    """Add the hash of every column but the id, the incremental load compares it"""
+    return frame.assign(content_hash=content_hash(frame, frame.columns.drop("id")))
+
+
+def load_orm(client, users, movies, ratings):
+    """Insert every row as an ORM object, committing every chunk of ratings"""
+    for model, frames in ((User, [users]), (Movie, [movies]), (Rating, ratings())):
+        for frame in frames:
+            client.db_session.add_all([model(**row) for _, row in frame.iterrows()])
+            client.db_session.commit()
+        count = client.db_session.query(model).count()
+        logger.info(f"Loaded {count} {model.__tablename__}")
+    # The counts leave a transaction open, which would block later DDL on the tables
+    client.db_session.remove()
+
+
+def load_copy(client, users, movies, ratings):
+    """Stream every table with COPY, building their indexes once loaded.
+
+    The ratings trigger is disabled during the load, the movie popularity is
+    rebuilt afterwards. The chunks of ratings are copied in a single transaction.
+    """
+    # COPY skips the Python side defaults of the models
+    created_at = datetime.datetime.now()
+    tables = [model.__table__ for model in (User, Movie, Rating)]
+
+    with deferred_indexes(client.engine, tables), disabled_triggers(
+        client.engine, Rating.__table__
+    ):
+        for table, frames in zip(tables, ([users], [movies], ratings())):
+            frames = (
+                frame.assign(created_at=created_at, updated_at=created_at)
+                for frame in frames
+            )
+            bulk_load(client.engine, table, frames)
+            reset_sequence(client.engine, table)
+
+    logger.info("Refreshing movie popularity")
+    client.refresh_popularity(client.engine)
+
+
+def load_incremental(client, users, movies, ratings):
+    """Upsert the new and changed rows, the tables stay online meanwhile.
+
+    Ratings older than the high-water mark of the previous load are not looked at.
+    Those with the same date are, the unchanged ones are skipped by their hash.
+    Rows removed from the files are kept. The ratings trigger updates the movie
+    popularity.
+    """
+    created_at = datetime.datetime.now()
+    with client.engine.begin() as conn:
+        high_water_mark = conn.execute(
+            select(LoadCheckpoint.high_water_mark).where(
+                LoadCheckpoint.source == Rating.__tablename__
+            )
+        ).scalar()
+        ratings = ratings()
+        if high_water_mark is not None:
+            logger.info(f"Reading the ratings since {high_water_mark}")
+            ratings = (chunk[chunk["date"] >= high_water_mark] for chunk in ratings)
 
-    # Insert movies into database
-    movies_to_add = []
-    for _, row in movies.iterrows():
-        movies_to_add.append(Movie(**row))
-    client.db_session.add_all(movies_to_add)
-    client.db_session.commit()
+        for model, frames in ((User, [users]), (Movie, [movies]), (Rating, ratings)):
+            rows = inserted = updated = 0
+            for frame in frames:
+                # Updated rows keep their created_at, their updated_at tells the
+                # running APIs to refresh them
+                frame = frame.assign(created_at=created_at, updated_at=created_at)
+                chunk_inserted, chunk_updated = upsert_dataframe(
+                    conn, model.__table__, frame
+                )
+                rows += len(frame)
+                inserted += chunk_inserted
+                updated += chunk_updated
+            logger.info(
+                f"{model.__tablename__}: {inserted} inserted, {updated} updated, "
+                f"{rows - inserted - updated} unchanged"
+            )
 
-    logger.info(f"Loaded {client.db_session.query(Movie).count()} movies")
+        # Saved with the rows, so a failed load reads the same ratings again
+        checkpoint = insert(LoadCheckpoint).from_select(
+            ["source", "high_water_mark", "updated_at"],
+            select(
+                literal(Rating.__tablename__),
+                func.max(Rating.date),
+                literal(created_at),
+            ).having(func.max(Rating.date).is_not(None)),
+        )
+        conn.execute(
+            checkpoint.on_conflict_do_update(
+                index_elements=[LoadCheckpoint.source],
+                set_={
+                    "high_water_mark": checkpoint.excluded.high_water_mark,
+                    "updated_at": checkpoint.excluded.updated_at,
+                },
+            )
+        )
 
-    logger.info("Loading Ratings data")
-    ratings = pd.read_csv("scores.csv")
-    ratings.columns = ["id", "user_id", "movie_id", "rating", "date"]
+    for model in (User, Movie, Rating):
+        reset_sequence(client.engine, model.__table__)
 
-    # Remove ratings with invalid movie ids
-    ratings = ratings[ratings["movie_id"].isin(movies["id"])]
 
-    # Remove ratings with invalid user ids
-    ratings = ratings[ratings["user_id"].isin(users["id"])]
+def copy_ratings(url, ratings, byte_range, created_at):
+    """Copy the ratings of a byte range of the file, in a worker process"""
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        frames = ratings(byte_range=byte_range)
+        frames = (
+            frame.assign(created_at=created_at, updated_at=created_at)
+            for frame in frames
+        )
+        return bulk_load(engine, Rating.__table__, frames)
+    finally:
+        engine.dispose()
 
-    # Insert ratings into database
-    ratings_to_add = []
-    for _, row in ratings.iterrows():
-        ratings_to_add.append(Rating(**row))
-    client.db_session.add_all(ratings_to_add)
-    client.db_session.commit()
 
-    logger.info(f"Loaded {client.db_session.query(Rating).count()} ratings")
+class LoadVerificationError(Exception):
+    """The loaded tables do not hold what was read from the files"""
+
+
+def verify_load(engine, expected):
+    """Check the row count of every table and that no rating lost its user or movie
+
+    :param expected: rows expected in each table, by model.
+    """
+    with engine.connect() as conn:
+        for model, rows in expected.items():
+            count = conn.execute(select(func.count()).select_from(model)).scalar()
+            if count != rows:
+                raise LoadVerificationError(
+                    f"{model.__tablename__} has {count} rows instead of {rows}"
+                )
+        orphans = conn.execute(
+            select(func.count())
+            .select_from(Rating)
+            .outerjoin(User, Rating.user_id == User.id)
+            .outerjoin(Movie, Rating.movie_id == Movie.id)
+            .where((User.id.is_(None)) | (Movie.id.is_(None)))
+        ).scalar()
+        if orphans:
+            raise LoadVerificationError(f"{orphans} ratings without user or movie")
+
+
+def load_parallel(client, users, movies, ratings, workers=None):
+    """Like the copy load, but users and movies are copied at the same time, and
+    the ratings file is split in byte ranges, each copied by a worker process.
+
+    Every range is committed on its own, so the row counts and foreign keys are
+    checked once all of them are in.
+    """
+    workers = workers or os.cpu_count()
+    created_at = datetime.datetime.now()
+    tables = [model.__table__ for model in (User, Movie, Rating)]
+    url = client.engine.url.render_as_string(hide_password=False)
+
+    with deferred_indexes(client.engine, tables), disabled_triggers(
+        client.engine, Rating.__table__
+    ):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            copies = [
+                pool.submit(
+                    bulk_load,
+                    client.engine,
+                    model.__table__,
+                    [frame.assign(created_at=created_at, updated_at=created_at)],
+                )
+                for model, frame in ((User, users), (Movie, movies))
+            ]
+            for copy in copies:
+                copy.result()
+
+        # The forked workers must not share the pooled connections
+        client.engine.dispose()
+        byte_ranges = line_ranges(RATINGS_FILE, workers)
+        logger.info(f"Copying {len(byte_ranges)} ranges of ratings")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            copies = [
+                pool.submit(copy_ratings, url, ratings, byte_range, created_at)
+                for byte_range in byte_ranges
+            ]
+            rows = sum(copy.result() for copy in copies)
+
+        for table in tables:
+            reset_sequence(client.engine, table)
+
+    verify_load(client.engine, {User: len(users), Movie: len(movies), Rating: rows})
+    logger.info(f"Verified {len(users)} users, {len(movies)} movies, {rows} ratings")
+
+    logger.info("Refreshing movie popularity")
+    client.refresh_popularity(client.engine)
+
+
+LOADERS = {
+    "copy": load_copy,
+    "orm": load_orm,
+    "incremental": load_incremental,
+    "parallel": load_parallel,
+}
+
+
+def load_data(mode="copy", chunk_rows=RATINGS_CHUNK_ROWS, workers=None):
+    config = ConfigurationManager.init_config()
+    # Only the incremental load keeps the existing rows
+    client = DatabaseService(config["sql"], drop_tables=mode != "incremental")
+
+    logger.info("Reading users, movies and ratings")
+    users = with_content_hash(read_users())
+    movies = with_content_hash(read_movies())
+    # The loaders read the ratings chunk by chunk, as they write them
+    ratings = functools.partial(
+        read_ratings,
+        users["id"].to_numpy(dtype="int32"),
+        movies["id"].to_numpy(dtype="int32"),
+        chunk_rows,
+    )
+
+    logger.info(f"Loading data with the {mode} loader")
+    loader = LOADERS[mode]
+    if mode == "parallel":
+        loader = functools.partial(loader, workers=workers)
+    loader(client, users, movies, ratings)
 
 
 if __name__ == "__main__":
-    load_data()
+    parser = argparse.ArgumentParser(description="Load the CSV files into Postgres")
+    parser.add_argument(
+        "--mode",
+        choices=LOADERS,
+        default="copy",
+        help="copy streams the tables with COPY, orm inserts ORM objects, "
+        "incremental upserts the new and changed rows into the existing tables, "
+        "parallel splits the ratings COPY across worker processes",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=RATINGS_CHUNK_ROWS,
+        help="number of ratings read and written at a time",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes of the parallel mode, one per CPU by default",
+    )
+    args = parser.parse_args()
+    load_data(args.mode, args.chunk_rows, args.workers)
@@ -6,6 +6,7 @@ from datetime import datetime
 
 import numpy as np
 import pandas as pd
+from build_neighbors import build_neighbors
 from core.services.configuration import ConfigurationManager
 from core.services.database import (
     DatabaseService,
@@ -31,7 +32,8 @@ logger = logging.getLogger(__name__)
 def load_embeddings():
 
     config = ConfigurationManager.init_config()
-    elastic_client = VectorDBService(config["elastic"])
+    # Embeddings are always indexed in OpenSearch, whatever backend the API reads from
+    elastic_client = VectorDBService({**config["elastic"], "backend": "opensearch"})
     sql_client = DatabaseService(config["sql"])
 
     logger.info("Loading embeddings and indexes")
@@ -46,7 +48,7 @@ def load_embeddings():
 
     # Make query statement
     logger.info("Getting movies from SQL Database")
-    stmt = select(Movie.id, Movie.url, Movie.name)
+    stmt = select(Movie.id, Movie.url, Movie.name, Movie.genres, Movie.release_date)
     movies = pd.read_sql(sql=stmt, con=sql_client.engine)
     logger.info(f"Total rows fetched: {movies.shape[0]}")
 
@@ -98,6 +100,8 @@ def load_embeddings():
             movie_id=row["id"],
             url=row["url"],
             name=row["name"],
+            genres=row["genres"] or [],
+            release_date=row["release_date"],
             vector=list(movie_embeddings_matrix[row["movieIdx"]]),
             created_at=datetime.now(),
         )
@@ -121,6 +125,11 @@ def load_embeddings():
     sql_client.db_session.commit()
     logger.info("User Embeddings successfully updated")
 
+    version = sql_client.add_embedding_version()
+    logger.info(f"Embedding version {version} recorded")
+
+    build_neighbors(embedding_version=version)
+
 
 if __name__ == "__main__":
     load_embeddings()
@@ -0,0 +1,321 @@
+"""Bring the ratings table of an existing database to the current schema.
+
+    indexes    create the missing indexes of the ratings model, without blocking writes
+    partition  turn ratings into a table partitioned by ranges of dates
+    extend     create the partitions of the next periods, moving their rows out of
+               the default partition
+    explain    check that the hot queries on ratings use their indexes
+
+A full load of load_data.py creates the tables from scratch, with the indexes but
+without partitions, so `partition` must be run again after one. Partitions are
+created `--ahead` periods past the current one: run `extend` periodically, with the
+same `--interval`, so new ratings never pile up in the default partition. The
+primary key of the partitioned table is (id, date), so nothing but the loader keeps
+ids unique: an incremental load moves a rating whose date changed by deleting its
+old row, other writers must do the same.
+"""
+
+import argparse
+import datetime
+import logging
+import sys
+
+import pandas as pd
+from core.services.configuration import ConfigurationManager
+from core.services.database import DatabaseService, Movie, Rating, User
+from core.services.database.models import MOVIE_POPULARITY_TRIGGER
+from sqlalchemy import func, select, text
+from sqlalchemy.schema import CreateIndex
+
+# Configure the logger
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler()],  # Ensures logs are sent to stdout
+)
+
+logger = logging.getLogger(__name__)
+
+# Length of every partition, as a pandas period frequency
+INTERVALS = {"year": "Y", "month": "M"}
+
+# Partitions created past the current period, so `extend` can run seldom
+PERIODS_AHEAD = 3
+
+
+def create_indexes(engine):
+    """Create the indexes of the ratings model that the table does not have yet.
+
+    They are built concurrently, so the API keeps writing ratings meanwhile.
+    """
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if is_partitioned(conn):
+            # Indexes of partitioned tables can not be built concurrently
+            for index in Rating.__table__.indexes:
+                index.create(bind=conn, checkfirst=True)
+            return
+        for index in Rating.__table__.indexes:
+            statement = str(
+                CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect)
+            )
+            logger.info(f"Creating index {index.name}")
+            conn.exec_driver_sql(
+                statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+            )
+        conn.execute(text("ANALYZE ratings"))
+
+
+def is_partitioned(conn):
+    return conn.execute(
+        text(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'ratings'"
+        )
+    ).first()
+
+
+def partition_bounds(first, last, interval):
+    """Yield the name suffix, start and end of every partition from `first` to `last`"""
+    frequency = INTERVALS[interval]
+    for period in pd.period_range(first, last, freq=frequency):
+        suffix = period.strftime("%Y" if interval == "year" else "%Y_%m")
+        yield suffix, period.start_time, (period + 1).start_time
+
+
+def last_period_start(interval, ahead):
+    """Return the start of the period `ahead` intervals after the current one"""
+    period = pd.Period(datetime.datetime.now(), freq=INTERVALS[interval])
+    return (period + ahead).start_time.to_pydatetime()
+
+
+def create_partition(conn, parent, suffix, start, end):
+    conn.execute(
+        text(
+            f"CREATE TABLE ratings_{suffix} PARTITION OF {parent} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    )
+
+
+def partition_ratings(engine, interval="year", ahead=PERIODS_AHEAD):
+    """Move the ratings into a table partitioned by `date` ranges of `interval`.
+
+    There is one partition per interval from the oldest rating to `ahead` intervals
+    after the current one, and a default partition for the dates out of them. The
+    primary key becomes (id, date), since it must hold the partition key, and `id`
+    alone is no longer
+    unique. The incremental loader deletes the old row of a rating whose date
+    changed. The table is locked while the rows are copied, so the API should be
+    stopped.
+    """
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            logger.info("The ratings table is already partitioned")
+            return
+        conn.execute(text("LOCK TABLE ratings IN ACCESS EXCLUSIVE MODE"))
+        first = conn.execute(select(func.min(Rating.date))).scalar()
+        last = max(
+            conn.execute(select(func.max(Rating.date))).scalar() or first,
+            last_period_start(interval, ahead),
+        )
+        first = first or last
+
+        conn.execute(
+            text(
+                "CREATE TABLE ratings_partitioned (LIKE ratings INCLUDING DEFAULTS) "
+                "PARTITION BY RANGE (date)"
+            )
+        )
+        conn.execute(
+            text(
+                "ALTER TABLE ratings_partitioned "
+                "ADD CONSTRAINT ratings_partitioned_pkey PRIMARY KEY (id, date), "
+                "ADD FOREIGN KEY (movie_id) REFERENCES movies (id), "
+                "ADD FOREIGN KEY (user_id) REFERENCES users (id)"
+            )
+        )
+        partitions = 0
+        for suffix, start, end in partition_bounds(first, last, interval):
+            create_partition(conn, "ratings_partitioned", suffix, start, end)
+            partitions += 1
+        conn.execute(
+            text(
+                "CREATE TABLE ratings_default PARTITION OF ratings_partitioned DEFAULT"
+            )
+        )
+        # The trigger is created after the copy, the popularity already counts them
+        rows = conn.execute(
+            text("INSERT INTO ratings_partitioned SELECT * FROM ratings")
+        ).rowcount
+
+        # Keep the id sequence, it belongs to the old table
+        conn.execute(
+            text(
+                "ALTER SEQUENCE ratings_id_seq OWNED BY ratings_partitioned.id; "
+                "DROP TABLE ratings; "
+                "ALTER TABLE ratings_partitioned RENAME TO ratings; "
+                "ALTER TABLE ratings "
+                "RENAME CONSTRAINT ratings_partitioned_pkey TO ratings_pkey"
+            )
+        )
+        for index in Rating.__table__.indexes:
+            index.create(bind=conn)
+        for statement in MOVIE_POPULARITY_TRIGGER:
+            conn.execute(statement)
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE ratings"))
+    logger.info(f"Moved {rows} ratings into {partitions} {interval} partitions")
+
+
+def extend_partitions(engine, interval="year", ahead=PERIODS_AHEAD):
+    """Create the missing partitions up to `ahead` intervals after the current one.
+
+    `interval` must be the one the table was partitioned with. Ratings of the new
+    periods that landed in the default partition are moved to their partition,
+    going through the popularity trigger on the way out and back in. The default
+    partition is locked meanwhile, which is short when it is run often enough to
+    keep it empty.
+    """
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            logger.info("The ratings table is not partitioned")
+            return
+        first = min(
+            conn.execute(text("SELECT min(date) FROM ratings_default")).scalar()
+            or datetime.datetime.now(),
+            datetime.datetime.now(),
+        )
+        missing = [
+            (suffix, start, end)
+            for suffix, start, end in partition_bounds(
+                first, last_period_start(interval, ahead), interval
+            )
+            if conn.execute(
+                text("SELECT to_regclass(:name)"), {"name": f"ratings_{suffix}"}
+            ).scalar()
+            is None
+        ]
+        if not missing:
+            logger.info("No partition is missing")
+            return
+
+        # A partition can not be created while the default one holds rows of its
+        # range, so they are set aside first
+        conn.execute(
+            text(
+                "CREATE TEMP TABLE ratings_moved (LIKE ratings) ON COMMIT DROP; "
+                "LOCK TABLE ratings_default IN ACCESS EXCLUSIVE MODE"
+            )
+        )
+        for suffix, start, end in missing:
+            conn.execute(
+                text(
+                    "WITH moved AS (DELETE FROM ratings_default "
+                    "WHERE date >= :start AND date < :end RETURNING *) "
+                    "INSERT INTO ratings_moved SELECT * FROM moved"
+                ),
+                {"start": start, "end": end},
+            )
+            create_partition(conn, "ratings", suffix, start, end)
+        rows = conn.execute(
+            text("INSERT INTO ratings SELECT * FROM ratings_moved")
+        ).rowcount
+    logger.info(
+        f"Created {len(missing)} {interval} partitions, moving {rows} ratings "
+        "out of the default one"
+    )
+
+
+def explain(conn, query):
+    """Return the plan of `query` as text, without running it"""
+    compiled = query.compile(
+        dialect=conn.dialect, compile_kwargs={"literal_binds": True}
+    )
+    return "\n".join(row[0] for row in conn.exec_driver_sql(f"EXPLAIN {compiled}"))
+
+
+def hot_queries(conn):
+    """Return the queries on ratings the API runs per request, with the index each
+    one must use"""
+    user_id = conn.execute(select(func.min(User.id))).scalar()
+    movie_id = conn.execute(select(func.min(Movie.id))).scalar()
+    return {
+        "user seeds": (
+            DatabaseService.seeds_query([user_id], 5),
+            "ix_ratings_user_rating",
+        ),
+        "ratings of a movie": (
+            select(func.count(), func.avg(Rating.rating)).where(
+                Rating.movie_id == movie_id
+            ),
+            "ix_ratings_movie",
+        ),
+    }
+
+
+def index_names(conn, index):
+    """Return the name of `index` and those of its copies in every partition"""
+    partitions = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:index)"
+        ),
+        {"index": index},
+    ).scalars()
+    return [index, *partitions]
+
+
+def check_plans(engine):
+    """Log the plan of every hot query and return whether all use their index"""
+    ok = True
+    with engine.connect() as conn:
+        for name, (query, index) in hot_queries(conn).items():
+            plan = explain(conn, query)
+            uses_index = any(
+                index_name in plan for index_name in index_names(conn, index)
+            )
+            ok = ok and uses_index
+            logger.info(f"{name}: {'uses' if uses_index else 'DOES NOT use'} {index}")
+            logger.info(f"\n{plan}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split("\n\n", 1)[1],
+    )
+    parser.add_argument(
+        "command", choices=["indexes", "partition", "extend", "explain"]
+    )
+    parser.add_argument(
+        "--interval",
+        choices=INTERVALS,
+        default="year",
+        help="range of dates of every partition",
+    )
+    parser.add_argument(
+        "--ahead",
+        type=int,
+        default=PERIODS_AHEAD,
+        help="partitions created past the current period",
+    )
+    args = parser.parse_args()
+
+    config = ConfigurationManager.init_config()
+    engine = DatabaseService(config["sql"]).engine
+    if args.command == "indexes":
+        create_indexes(engine)
+    elif args.command == "partition":
+        partition_ratings(engine, args.interval, args.ahead)
+    elif args.command == "extend":
+        extend_partitions(engine, args.interval, args.ahead)
+    elif not check_plans(engine):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()